@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -37,3 +39,19 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def temporary_cache(django_test_environment):
+    from core.test_runner import temporary_cache
+
+    with temporary_cache():
+        yield
+
+
+@pytest.fixture(autouse=True)
+def inline_background_jobs(settings):
+    # Фоновые потоки миниатюр и удаления картинок пишут в ту же тестовую
+    # базу и мешают pytest-django очищать её между тестами.
+    settings.POST_THUMBNAIL_WORKERS = 0
+    settings.POST_IMAGE_CLEANUP_IN_BACKGROUND = False
@@ -0,0 +1,268 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB, expires REAL,'
+    ' accessed REAL NOT NULL, size INTEGER NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_meta ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+    ' entries INTEGER NOT NULL, bytes INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO cache_meta VALUES (1, 0, 0)',
+)
+
+# Ограничение SQLite на число параметров в одном запросе.
+BATCH_SIZE = 500
+
+# Время доступа для LRU обновляется не чаще раза в столько секунд,
+# чтобы чтение из кэша почти никогда не требовало записи.
+ACCESS_RESOLUTION = 10
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite (WAL), общий для всех процессов на хосте.
+
+    Поддерживает вытеснение давно не читанных записей по числу
+    (MAX_ENTRIES) и суммарному размеру (MAX_SIZE), атомарный incr()
+    для счётчиков версий и пакетные get_many()/set_many().
+    Целые числа хранятся как INTEGER, остальное - как pickle.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._mmap_size = int(options.get('MMAP_SIZE', self._max_size))
+        self._busy_timeout = float(options.get('BUSY_TIMEOUT', 5))
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        # Соединение своё у каждого потока и процесса: после fork()
+        # унаследованным соединением SQLite пользоваться нельзя.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(
+                self._path, timeout=self._busy_timeout,
+                isolation_level=None, check_same_thread=False,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={self._mmap_size}')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    @staticmethod
+    def _dump(value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    @staticmethod
+    def _size(value):
+        return 8 if isinstance(value, int) else len(value)
+
+    def _live_row(self, conn, key, now):
+        return conn.execute(
+            'SELECT value FROM cache WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)', (key, now)
+        ).fetchone()
+
+    def _store(self, conn, key, value, timeout, now):
+        stored = self._dump(value)
+        size = self._size(stored)
+        old = conn.execute(
+            'SELECT size FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+            (key, stored, self.get_backend_timeout(timeout), now, size),
+        )
+        conn.execute(
+            'UPDATE cache_meta SET entries = entries + ?, bytes = bytes + ?',
+            (0 if old else 1, size - (old[0] if old else 0)),
+        )
+
+    def _remove(self, conn, where, params):
+        entries, size = conn.execute(
+            f'SELECT COUNT(*), TOTAL(size) FROM cache WHERE {where}', params
+        ).fetchone()
+        if entries:
+            conn.execute(f'DELETE FROM cache WHERE {where}', params)
+            conn.execute(
+                'UPDATE cache_meta SET entries = entries - ?,'
+                ' bytes = bytes - ?', (entries, int(size)),
+            )
+        return entries
+
+    def _cull(self, conn, now):
+        entries, size = conn.execute(
+            'SELECT entries, bytes FROM cache_meta'
+        ).fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return
+        self._remove(conn, 'expires IS NOT NULL AND expires <= ?', (now,))
+        entries, size = conn.execute(
+            'SELECT entries, bytes FROM cache_meta'
+        ).fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return
+        # Вытесняем самые давно прочитанные записи: по числу - долю
+        # 1/CULL_FREQUENCY, по размеру - пока не уложимся в лимит.
+        excess = max(entries - self._max_entries, 0)
+        if excess and self._cull_frequency:
+            excess = max(excess, entries // self._cull_frequency)
+        victims = []
+        freed = 0
+        rows = conn.execute('SELECT key, size FROM cache ORDER BY accessed')
+        for key, item_size in rows:
+            if len(victims) >= excess and size - freed <= self._max_size:
+                break
+            victims.append(key)
+            freed += item_size
+        for start in range(0, len(victims), BATCH_SIZE):
+            batch = victims[start:start + BATCH_SIZE]
+            self._remove(
+                conn, f'key IN ({", ".join("?" * len(batch))})', batch
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            if self._live_row(conn, key, now):
+                return False
+            self._store(conn, key, value, timeout, now)
+            self._cull(conn, now)
+        return True
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        key_map = {self._key(key, version): key for key in keys}
+        conn = self._connection
+        now = time.time()
+        result = {}
+        stored_keys = list(key_map)
+        for start in range(0, len(stored_keys), BATCH_SIZE):
+            batch = stored_keys[start:start + BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            rows = conn.execute(
+                'SELECT key, value, accessed FROM cache'
+                f' WHERE key IN ({placeholders})'
+                ' AND (expires IS NULL OR expires > ?)', (*batch, now)
+            ).fetchall()
+            touched = []
+            for key, value, accessed in rows:
+                result[key_map[key]] = self._load(value)
+                if now - accessed > ACCESS_RESOLUTION:
+                    touched.append(key)
+            if touched:
+                conn.execute(
+                    f'UPDATE cache SET accessed = ? WHERE key IN '
+                    f'({", ".join("?" * len(touched))})', (now, *touched),
+                )
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        with self._write() as conn:
+            for key, value in data.items():
+                self._store(conn, self._key(key, version), value, timeout,
+                            now)
+            self._cull(conn, now)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            updated = conn.execute(
+                'UPDATE cache SET expires = ?, accessed = ? WHERE key = ?'
+                ' AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), now, key, now),
+            ).rowcount
+        return bool(updated)
+
+    def incr(self, key, delta=1, version=None):
+        stored_key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            row = self._live_row(conn, stored_key, now)
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = self._load(row[0]) + delta
+            conn.execute(
+                'UPDATE cache SET value = ?, accessed = ? WHERE key = ?',
+                (self._dump(value), now, stored_key),
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._live_row(self._connection, key, time.time()) is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._write() as conn:
+            for start in range(0, len(keys), BATCH_SIZE):
+                batch = keys[start:start + BATCH_SIZE]
+                self._remove(
+                    conn, f'key IN ({", ".join("?" * len(batch))})', batch
+                )
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute('DELETE FROM cache')
+            conn.execute('UPDATE cache_meta SET entries = 0, bytes = 0')
+
+    def close(self, **kwargs):
+        # Соединение держим открытым между запросами: открытие файла
+        # и PRAGMA дороже самих операций кэша.
+        pass
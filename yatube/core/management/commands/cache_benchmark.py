@@ -0,0 +1,65 @@
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache import SQLiteCache
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает SQLiteCache с LocMemCache и FileBasedCache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=2000)
+        parser.add_argument('--keys', type=int, default=500)
+        parser.add_argument(
+            '--value-size', type=int, default=2048,
+            help='Размер значения в байтах (фрагмент HTML)'
+        )
+
+    def handle(self, *args, **options):
+        operations = options['operations']
+        keys = [f'key:{i}' for i in range(options['keys'])]
+        value = 'x' * options['value_size']
+        params = {'OPTIONS': {'MAX_ENTRIES': len(keys) * 2}}
+        with tempfile.TemporaryDirectory() as directory:
+            backends = {
+                'locmem': LocMemCache('benchmark', params),
+                'filebased': FileBasedCache(f'{directory}/files', params),
+                'sqlite': SQLiteCache(f'{directory}/cache.sqlite3', params),
+            }
+            self.stdout.write(
+                f'{"backend":<10}{"set":>10}{"get":>10}'
+                f'{"get_many":>10}{"incr":>10}   ops/s'
+            )
+            for name, backend in backends.items():
+                results = self.run(backend, keys, value, operations)
+                self.stdout.write(
+                    f'{name:<10}' + ''.join(f'{rate:>10.0f}'
+                                            for rate in results)
+                )
+
+    @staticmethod
+    def measure(operation, count):
+        started = time.perf_counter()
+        for i in range(count):
+            operation(i)
+        return count / (time.perf_counter() - started)
+
+    def run(self, backend, keys, value, operations):
+        backend.clear()
+        backend.set('counter', 0)
+        batches = [keys[i:i + 10] for i in range(0, len(keys), 10)]
+        return (
+            self.measure(
+                lambda i: backend.set(keys[i % len(keys)], value),
+                operations),
+            self.measure(
+                lambda i: backend.get(keys[i % len(keys)]), operations),
+            self.measure(
+                lambda i: backend.get_many(batches[i % len(batches)]),
+                operations // 10),
+            self.measure(lambda i: backend.incr('counter'), operations),
+        )
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from .cache import SQLiteCache
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_set_get_delete(self):
+        """Значения сохраняются, читаются и удаляются."""
+        self.cache.set('text', 'значение')
+        self.cache.set('data', {'posts': [1, 2]})
+        self.assertEqual(self.cache.get('text'), 'значение')
+        self.assertEqual(self.cache.get('data'), {'posts': [1, 2]})
+        self.cache.delete('text')
+        self.assertIsNone(self.cache.get('text'))
+        self.assertEqual(self.cache.get('text', 'нет'), 'нет')
+
+    def test_visible_from_other_process(self):
+        """Запись одного экземпляра видна другому на том же файле."""
+        other = self.make_cache()
+        self.cache.set('version', 1)
+        other.incr('version')
+        self.assertEqual(self.cache.get('version'), 2)
+
+    def test_add_and_incr(self):
+        """add() не перезаписывает ключ, incr() атомарно прибавляет."""
+        self.assertTrue(self.cache.add('counter', 10))
+        self.assertFalse(self.cache.add('counter', 0))
+        self.assertEqual(self.cache.incr('counter', 5), 15)
+        self.assertEqual(self.cache.decr('counter'), 14)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_get_many_set_many(self):
+        """Пакетные операции читают и пишут несколько ключей."""
+        self.cache.set_many({'a': 1, 'b': 'два', 'c': [3]})
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c', 'd']),
+            {'a': 1, 'b': 'два', 'c': [3]},
+        )
+
+    def test_expired_values(self):
+        """Просроченные значения не возвращаются."""
+        self.cache.set('old', 'value', timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('old'))
+        self.assertFalse(self.cache.has_key('old'))
+        self.assertTrue(self.cache.add('old', 'new'))
+
+    def test_lru_eviction_by_entries(self):
+        """При переполнении вытесняются давно не читанные ключи."""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache._connection.execute(
+            'UPDATE cache SET accessed = accessed + 100 WHERE key = ?',
+            (cache.make_key('a'),)
+        )
+        cache.set('d', 'd')
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']),
+                         {'a': 'a', 'c': 'c', 'd': 'd'})
+
+    def test_eviction_by_size(self):
+        """Суммарный размер значений не превышает MAX_SIZE."""
+        cache = self.make_cache(MAX_SIZE=10000)
+        for i in range(10):
+            cache.set(f'key{i}', b'x' * 3000)
+        entries, size = cache._connection.execute(
+            'SELECT entries, bytes FROM cache_meta'
+        ).fetchone()
+        self.assertLessEqual(size, 10000)
+        self.assertEqual(entries, len(cache.get_many(
+            [f'key{i}' for i in range(10)]
+        )))
+        self.assertIsNotNone(cache.get('key9'))
+
+    def test_clear(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.clear()
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+
+
+class TestCacheLocationTests(SimpleTestCase):
+    def test_tests_do_not_share_server_cache(self):
+        """Тесты пишут не в файл кэша сервера."""
+        location = settings.CACHES['default']['LOCATION']
+        self.assertNotEqual(
+            location, os.path.join(settings.BASE_DIR, 'cache.sqlite3')
+        )
+        self.assertTrue(location.startswith(tempfile.gettempdir()))
+        self.assertEqual(caches['default']._path, location)
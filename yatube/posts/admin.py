@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Comment, Follow, Group, Post
+from .models import (Comment, Follow, Group, ObsoleteImage, Post,
+                     StoredImage, Upload, UserStats)
 
 
 class CommentInline(admin.TabularInline):
@@ -25,3 +26,7 @@ admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
 admin.site.register(Follow)
 admin.site.register(Comment)
+admin.site.register(UserStats)
+admin.site.register(StoredImage)
+admin.site.register(ObsoleteImage)
+admin.site.register(Upload)
@@ -0,0 +1,55 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, max_workers=1):
+    """Пул потоков с префиксом name, создаётся при первом обращении."""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=name
+            )
+        return _executors[name]
+
+
+class BackgroundJob:
+    """Задача, которая целиком выполняется в отдельном потоке.
+
+    Один запуск разбирает всю накопившуюся работу, поэтому повторный
+    schedule(), пока прежний запуск не начался, ничего не добавляет.
+    Ошибки пишутся в лог с сообщением error_message.
+    """
+
+    def __init__(self, name, func, error_message):
+        self.name = name
+        self._func = func
+        self._error_message = error_message
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        get_executor(self.name).submit(self._run)
+
+    def _run(self):
+        with self._lock:
+            self._scheduled = False
+        close_old_connections()
+        try:
+            self._func()
+        except Exception:
+            logger.exception(self._error_message)
+        finally:
+            close_old_connections()
@@ -0,0 +1,63 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{}'
+
+# Общая лента: меняется при любой записи постов и групп.
+FEED = 'feed'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def follower_scope(user_id):
+    return f'follower:{user_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Версии содержимого областей для ключей кэша и ETag.
+
+    Версия - это отметка времени последнего изменения в миллисекундах.
+    Если ключ вытеснен из кэша, версия начинается заново с текущего
+    времени и поэтому не совпадает ни с одной из прежних.
+    """
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = _now_ms()
+        for key in missing:
+            cache.add(key, now, None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def get_version(scope):
+    return get_versions(scope)[0]
+
+
+def bump_versions(*scopes):
+    """Отмечает изменение содержимого областей."""
+    now = _now_ms()
+    for scope in scopes:
+        key = VERSION_KEY.format(scope)
+        try:
+            # incr() атомарен, поэтому версия строго растёт даже при
+            # одновременных изменениях, оставаясь близкой ко времени.
+            cache.incr(key, max(now - (cache.get(key) or 0), 1))
+        except ValueError:
+            cache.add(key, now, None)
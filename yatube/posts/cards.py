@@ -0,0 +1,97 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .thumbnails import prefetch_thumbnails
+
+CARD_TEMPLATE = 'includes/post.html'
+
+CARD_KEY = 'card:{template}:{id}:{version}'
+
+# Счётчики попаданий копятся в процессе и переносятся в общий кэш
+# раз в столько карточек, чтобы не писать в кэш на каждой странице.
+STATS_KEY = 'card-stats:{}'
+STATS_FLUSH_EVERY = 100
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def card_key(post, template=CARD_TEMPLATE):
+    return CARD_KEY.format(template=template, id=post.id,
+                           version=post.version)
+
+
+def attach_cards(posts, template=CARD_TEMPLATE):
+    """Раскладывает по постам страницы готовый HTML карточек в post.card.
+
+    Карточки всей страницы читаются одним get_many. Любая правка поста,
+    его комментариев или миниатюр поднимает post.version, поэтому
+    прежняя карточка просто перестаёт читаться. Отсутствующие карточки
+    рендерятся шаблоном template (миниатюры для них читаются одним
+    пакетом) и записываются одним set_many.
+    """
+    posts = list(posts)
+    keys = {card_key(post, template): post for post in posts}
+    found = cache.get_many(list(keys))
+    missing = [post for key, post in keys.items() if key not in found]
+    prefetch_thumbnails(missing)
+    rendered = {}
+    for post in missing:
+        rendered[card_key(post, template)] = render_to_string(
+            template, {'post': post}
+        )
+    if rendered:
+        cache.set_many(rendered, settings.POST_CACHE_TIMEOUT)
+    found.update(rendered)
+    for key, post in keys.items():
+        post.card = mark_safe(found[key])
+    _count(len(posts) - len(missing), len(missing))
+    return posts
+
+
+def _count(hits, misses):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+        if _stats['hits'] + _stats['misses'] < STATS_FLUSH_EVERY:
+            return
+    flush_card_stats()
+
+
+def flush_card_stats():
+    """Переносит накопленные в процессе счётчики в общий кэш."""
+    with _stats_lock:
+        pending = dict(_stats)
+        _stats.update(hits=0, misses=0)
+    for name, value in pending.items():
+        if not value:
+            continue
+        key = STATS_KEY.format(name)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            if not cache.add(key, value, None):
+                cache.incr(key, value)
+
+
+def card_stats():
+    """Попадания и промахи кэша карточек всех процессов и их доля."""
+    flush_card_stats()
+    hits = cache.get(STATS_KEY.format('hits'), 0)
+    misses = cache.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_card_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+    cache.delete_many([STATS_KEY.format(name) for name in _stats])
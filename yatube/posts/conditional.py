@@ -0,0 +1,91 @@
+import hashlib
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.views.decorators.http import condition
+
+from .caching import (FEED, author_scope, get_versions, group_scope,
+                      post_scope)
+from .models import Group, Post, User
+
+
+def index_scopes(request):
+    return [FEED]
+
+
+def group_scopes(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'id', flat=True).first()
+    if group_id is None:
+        return None
+    return [group_scope(group_id)]
+
+
+def profile_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'id', flat=True).first()
+    if author_id is None:
+        return None
+    return [author_scope(author_id)]
+
+
+def post_scopes(request, post_id):
+    found = Post.objects.filter(pk=post_id).values_list(
+        'author_id', 'group_id').first()
+    if found is None:
+        return None
+    author_id, group_id = found
+    scopes = [post_scope(post_id), author_scope(author_id)]
+    if group_id:
+        scopes.append(group_scope(group_id))
+    return scopes
+
+
+def comments_scopes(request, post_id):
+    # Комментарии поста меняют только версию поста.
+    return [post_scope(post_id)]
+
+
+def content_condition(scopes):
+    """Условный GET для страницы, зависящей от версий областей.
+
+    scopes(request, *args, **kwargs) возвращает список областей
+    или None, если объекта нет (тогда страница отдаётся как обычно
+    и сама отвечает 404). Ответ 304 вычисляется только по версиям из
+    кэша и дешёвым поискам id, без запроса ленты и рендеринга.
+    Last-Modified отдаётся только анонимным пользователям.
+    """
+    def versions(request, *args, **kwargs):
+        if not hasattr(request, '_content_versions'):
+            found = scopes(request, *args, **kwargs)
+            request._content_versions = (
+                None if found is None else get_versions(*found)
+            )
+        return request._content_versions
+
+    def etag(request, *args, **kwargs):
+        values = versions(request, *args, **kwargs)
+        if values is None:
+            return None
+        # Шапка страницы и формы зависят от пользователя и его
+        # CSRF-cookie, поэтому они входят в тег вместе с версиями.
+        parts = [
+            str(request.user.pk or ''),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            *map(str, values),
+        ]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        # Дата не различает пользователей, как ETag: по ней другой клиент
+        # получил бы 304 на чужую шапку. Поэтому она отдаётся только
+        # анонимам, у которых страница одна на всех.
+        if request.user.is_authenticated:
+            return None
+        values = versions(request, *args, **kwargs)
+        if not values:
+            return None
+        return datetime.fromtimestamp(max(values) / 1000, tz=timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,129 @@
+import heapq
+
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils.functional import cached_property
+
+from .models import FeedItem, Follow, Post, UserStats
+from .paginators import keyset_q
+
+RECENT_POSTS_KEY = 'recent_posts:{}'
+
+
+def is_pull_author(author_id):
+    """Посты автора с большим числом подписчиков не раскладываются.
+
+    Такие посты подтягиваются в ленты подписчиков при чтении.
+    """
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.FEED_PUSH_MAX_FOLLOWERS,
+    ).exists()
+
+
+def recent_posts(author_ids):
+    """Последние посты авторов в виде списков (pub_date, id) по убыванию."""
+    keys = {RECENT_POSTS_KEY.format(author_id): author_id
+            for author_id in author_ids}
+    cached = cache.get_many(keys)
+    result = {keys[key]: entries for key, entries in cached.items()}
+    missing = {}
+    for key, author_id in keys.items():
+        if key in cached:
+            continue
+        entries = list(
+            Post.objects.filter(author_id=author_id)
+            .order_by('-pub_date', '-id')
+            .values_list('pub_date', 'id')[:settings.FEED_RECENT_POSTS]
+        )
+        result[author_id] = missing[key] = entries
+    if missing:
+        cache.set_many(missing, settings.FEED_RECENT_POSTS_TIMEOUT)
+    return result
+
+
+def forget_recent_posts(author_id):
+    cache.delete(RECENT_POSTS_KEY.format(author_id))
+
+
+class FollowFeed:
+    """Гибридная лента подписок пользователя.
+
+    Посты обычных авторов читаются из материализованной ленты FeedItem,
+    посты популярных авторов подтягиваются при чтении из кэша последних
+    постов. Потоки сливаются k-way слиянием на куче.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def pull_author_ids(self):
+        return list(
+            Follow.objects.filter(
+                user=self.user,
+                author__stats__followers_count__gt=(
+                    settings.FEED_PUSH_MAX_FOLLOWERS
+                ),
+            ).values_list('author_id', flat=True)
+        )
+
+    def _pushed(self, limit, lookup, cursor):
+        items = FeedItem.objects.filter(user=self.user).exclude(
+            author_id__in=self.pull_author_ids
+        )
+        order = ('-pub_date', '-post_id') if lookup == 'lt' else (
+            'pub_date', 'post_id')
+        if cursor is not None:
+            items = items.filter(keyset_q(('pub_date', 'post_id'), lookup,
+                                          cursor))
+        return list(
+            items.order_by(*order).values_list('pub_date', 'post_id')[:limit]
+        )
+
+    def _pulled(self, author_id, entries, limit, lookup, cursor):
+        full = len(entries) >= settings.FEED_RECENT_POSTS
+        if lookup == 'lt':
+            candidates = [entry for entry in entries
+                          if cursor is None or entry < cursor]
+            if len(candidates) >= limit or not full:
+                return candidates[:limit]
+        elif not full or cursor >= entries[-1]:
+            candidates = [entry for entry in reversed(entries)
+                          if entry > cursor]
+            return candidates[:limit]
+        # Курсор ушёл глубже кэшированного окна: читаем автора из базы.
+        order = ('-pub_date', '-id') if lookup == 'lt' else ('pub_date', 'id')
+        posts = Post.objects.filter(author_id=author_id)
+        if cursor is not None:
+            posts = posts.filter(keyset_q(('pub_date', 'id'), lookup, cursor))
+        return list(
+            posts.order_by(*order).values_list('pub_date', 'id')[:limit]
+        )
+
+    def post_ids(self, limit, after=None, before=None):
+        """id постов после after (по убыванию) или перед before."""
+        lookup, cursor = ('gt', before) if before is not None else (
+            'lt', after)
+        streams = [self._pushed(limit, lookup, cursor)]
+        pulled = recent_posts(self.pull_author_ids)
+        streams += [
+            self._pulled(author_id, entries, limit, lookup, cursor)
+            for author_id, entries in pulled.items()
+        ]
+        merged = heapq.merge(*streams, reverse=lookup == 'lt')
+        return [post_id for _, post_id in islice(merged, limit)]
+
+    def count(self):
+        """Число постов в ленте по счётчикам постов авторов."""
+        return UserStats.objects.filter(
+            user__following__user=self.user
+        ).aggregate(total=Sum('posts_count'))['total'] or 0
+
+    def posts(self, limit, after=None, before=None):
+        post_ids = self.post_ids(limit, after=after, before=before)
+        posts = Post.objects.for_feed().in_bulk(post_ids)
+        return [posts[pk] for pk in post_ids if pk in posts]
@@ -1,15 +1,70 @@
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
+from PIL import Image
 
+from .images import normalize_image
 from .models import Post, Comment
+from .uploads import UPLOAD_TOKEN, open_upload
 
 
 class PostForm(ModelForm):
+    """Форма поста.
+
+    Картинку можно прислать файлом или токеном завершённой загрузки
+    частями (поле upload_token вне полей модели); для токена форме
+    нужен пользователь.
+    """
 
     class Meta:
         model = Post
         fields = ('group', 'text', 'image')
         labels = {'text': 'Текст поста', 'group': 'Группа'}
 
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.upload = None
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        token = self.data.get(UPLOAD_TOKEN)
+        if token and not isinstance(image, UploadedFile):
+            self.upload, upload_file = open_upload(self.user, token)
+            image = None
+            try:
+                image = normalize_image(upload_file)
+            except (OSError, Image.DecompressionBombError):
+                # Файл загрузки не проверялся полем ImageField.
+                raise ValidationError(
+                    'Загруженный файл не является картинкой.',
+                    code='invalid_image',
+                )
+            finally:
+                # Анимированная картинка возвращается как есть и
+                # читается при сохранении поста.
+                if image is not upload_file:
+                    upload_file.close()
+        # Нормализуется только новая загрузка, а не уже сохранённый файл.
+        elif isinstance(image, UploadedFile):
+            try:
+                image = normalize_image(image)
+            except (OSError, Image.DecompressionBombError):
+                # ImageField.verify() не декодирует пиксели, поэтому
+                # обрезанный JPEG обнаруживается только здесь.
+                raise ValidationError(
+                    'Картинка повреждена.', code='invalid_image'
+                )
+        return image
+
+    def save(self, commit=True):
+        post = super().save(commit)
+        if commit and self.upload is not None:
+            # Файл уже в хранилище картинок, загрузка больше не нужна.
+            post.image.close()
+            self.upload.delete()
+        return post
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,216 @@
+import base64
+import io
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files import File
+from django.db import transaction
+from PIL import Image, ImageOps
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .background import BackgroundJob
+from .models import ObsoleteImage, StoredImage
+
+logger = logging.getLogger(__name__)
+
+# Форматы, в которых картинка пересохраняется как есть; остальные
+# перекодируются в PNG (с прозрачностью) или JPEG.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85, 'method': 4},
+    'GIF': {'optimize': True},
+}
+
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+# Из метаданных сохраняются только те, без которых меняется картинка.
+KEPT_INFO = ('icc_profile', 'transparency')
+
+EXIF_ORIENTATION = 0x0112
+
+# Ориентации EXIF, при которых картинка поворачивается на 90 градусов.
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+PLACEHOLDER_OPTIONS = {'quality': 60, 'optimize': True}
+
+METADATA_FIELDS = (
+    'image_width', 'image_height', 'image_size', 'image_placeholder'
+)
+
+
+def _output_format(image, source_format):
+    if source_format in SAVE_OPTIONS:
+        return source_format
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        return 'PNG'
+    return 'JPEG'
+
+
+def normalize_image(upload):
+    """Проверяет загруженную картинку и готовит её к хранению.
+
+    Файл читается потоком: сначала проверяются размер в байтах и число
+    пикселей по заголовку, JPEG декодируется сразу в уменьшенном
+    масштабе. Затем применяется EXIF-ориентация, картинка уменьшается
+    до POST_IMAGE_MAX_SIDE по большей стороне и пересохраняется без
+    метаданных. Анимированные картинки только проверяются.
+    Возвращает File для Post.image.
+    """
+    max_bytes = settings.POST_IMAGE_MAX_BYTES
+    if upload.size > max_bytes:
+        raise ValidationError(
+            f'Файл больше {max_bytes // (1024 * 1024)} МБ.',
+            code='file_too_large',
+        )
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f'Картинка {width}x{height} слишком большая.',
+            code='too_many_pixels',
+        )
+    if getattr(image, 'is_animated', False):
+        upload.seek(0)
+        return upload
+    source_format = image.format
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    image.draft(image.mode, (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    output_format = _output_format(image, source_format)
+    if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    params = {key: image.info[key] for key in KEPT_INFO if key in image.info}
+    params.update(SAVE_OPTIONS[output_format])
+    # Некоторые кодировщики берут EXIF и XMP из info по умолчанию.
+    image.info = {}
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    image.save(output, output_format, **params)
+    output.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return File(output, name=name + EXTENSIONS[output_format])
+
+
+def _placeholder(image):
+    """Микроминиатюра картинки в виде data URI для встраивания."""
+    side = settings.POST_IMAGE_PLACEHOLDER_SIDE
+    image.draft('RGB', (side, side))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        # Прозрачные области заглушки - белые, как фон карточки.
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, 'white')
+        image = Image.alpha_composite(background, image).convert('RGB')
+    image.thumbnail((side, side))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', **PLACEHOLDER_OPTIONS)
+    encoded = base64.b64encode(output.getvalue()).decode('ascii')
+    return f'data:image/jpeg;base64,{encoded}'
+
+
+def image_metadata(field_file):
+    """Размеры, размер в байтах и заглушка картинки поста.
+
+    Загруженный, ещё не сохранённый файл читается из памяти, иначе файл
+    открывается в хранилище. Для пустого, отсутствующего или битого
+    файла все значения пустые - пост сохраняется и без них.
+    """
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    metadata['image_placeholder'] = ''
+    if not field_file:
+        return metadata
+    try:
+        if field_file._committed:
+            field_file.open('rb')
+        file = field_file.file
+        size = field_file.size
+        file.seek(0)
+        image = Image.open(file)
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+        placeholder = _placeholder(image)
+        file.seek(0)
+    except (OSError, SuspiciousFileOperation, Image.DecompressionBombError):
+        logger.warning(
+            'Не удалось прочитать картинку %s', field_file.name, exc_info=True
+        )
+        return metadata
+    finally:
+        if field_file._committed:
+            field_file.close()
+    metadata.update(
+        image_width=width, image_height=height, image_size=size,
+        image_placeholder=placeholder,
+    )
+    return metadata
+
+
+def delete_image_files(name):
+    """Удаляет файл картинки вместе с её миниатюрами sorl."""
+    try:
+        default.backend.delete(ImageFile(name))
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Не удалось удалить картинку %s', name, exc_info=True)
+
+
+def delete_obsolete_images(batch_size=None):
+    """Удаляет файлы из очереди ObsoleteImage порциями.
+
+    Файл, на который снова появилась ссылка (ту же картинку загрузили
+    ещё раз), только убирается из очереди. Возвращает число удалённых
+    картинок.
+    """
+    batch_size = batch_size or settings.POST_IMAGE_CLEANUP_BATCH_SIZE
+    deleted = 0
+    while True:
+        names = list(
+            ObsoleteImage.objects.order_by('created')
+            .values_list('name', flat=True)[:batch_size]
+        )
+        if not names:
+            return deleted
+        in_use = set(
+            StoredImage.objects.filter(name__in=names)
+            .values_list('name', flat=True)
+        )
+        for name in names:
+            if name not in in_use:
+                delete_image_files(name)
+                deleted += 1
+        ObsoleteImage.objects.filter(name__in=names).delete()
+
+
+_cleanup_job = BackgroundJob(
+    'image-cleanup', delete_obsolete_images,
+    'Не удалось удалить устаревшие картинки',
+)
+
+
+def _schedule_cleanup():
+    if not settings.POST_IMAGE_CLEANUP_IN_BACKGROUND:
+        delete_obsolete_images()
+        return
+    _cleanup_job.schedule()
+
+
+def release_image(name):
+    """Снимает ссылку поста на файл.
+
+    Файл без ссылок записывается в очередь в той же транзакции, а
+    удаляется в фоне после её фиксации: запрос не ждёт файловую систему.
+    """
+    if StoredImage.release(name):
+        ObsoleteImage.objects.bulk_create(
+            [ObsoleteImage(name=name)], ignore_conflicts=True
+        )
+        transaction.on_commit(_schedule_cleanup)
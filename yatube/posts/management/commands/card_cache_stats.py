@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts.cards import card_stats, reset_card_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает долю попаданий в кэш карточек постов лент'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счётчики после вывода'
+        )
+
+    def handle(self, *args, **options):
+        stats = card_stats()
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {stats["hit_rate"]:.1%}'
+        )
+        if options['reset']:
+            reset_card_stats()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import delete_obsolete_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы картинок из очереди на удаление, например '
+        'оставшиеся после перезапуска сервера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Сколько файлов удалять за один проход'
+        )
+
+    def handle(self, *args, **options):
+        deleted = delete_obsolete_images(options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Удалено картинок: {deleted}')
+        )
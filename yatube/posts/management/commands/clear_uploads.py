@@ -0,0 +1,39 @@
+import os
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import Upload
+from posts.uploads import delete_upload_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет загрузки частями, которые не завершили или не '
+        'прикрепили к посту за UPLOAD_EXPIRY'
+    )
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRY)
+        # Файлы удаляет сигнал post_delete модели Upload.
+        deleted, _ = Upload.objects.filter(created__lt=expired).delete()
+        # Файл без записи остаётся, если его не удалось удалить вместе
+        # с записью.
+        orphans = 0
+        if os.path.isdir(settings.UPLOAD_DIR):
+            tokens = {
+                str(token) for token in
+                Upload.objects.values_list('token', flat=True)
+            }
+            for entry in os.scandir(settings.UPLOAD_DIR):
+                token = entry.name.split('.')[0]
+                if (token not in tokens
+                        and entry.stat().st_mtime < expired.timestamp()):
+                    delete_upload_file(entry.path)
+                    orphans += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено загрузок: {deleted}, файлов без загрузки: {orphans}'
+        ))
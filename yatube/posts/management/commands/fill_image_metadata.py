@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import image_metadata
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет размеры, размер файла и заглушки картинок '
+        'у существующих постов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать и уже заполненные посты'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        if not options['all']:
+            posts = posts.filter(image_width__isnull=True)
+        # Одинаковые картинки делят файл, поэтому каждый файл читается
+        # один раз и обновляется одним запросом для всех его постов.
+        names = posts.order_by().values_list('image', flat=True).distinct()
+        filled = failed = 0
+        for name in list(names):
+            metadata = image_metadata(Post(image=name).image)
+            if metadata['image_width'] is None:
+                failed += 1
+                continue
+            filled += posts.filter(image=name).update(**metadata)
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено постов: {filled}, не прочитано картинок: {failed}'
+        ))
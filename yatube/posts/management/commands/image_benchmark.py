@@ -0,0 +1,90 @@
+import io
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.images import normalize_image
+from posts.thumbnails import thumbnail_options, thumbnail_variants
+
+EXIF_ORIENTATION = 0x0112
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время генерации миниатюр из снимка камеры '
+        'до и после нормализации при загрузке'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        original = self.camera_jpeg(options['width'], options['height'])
+        started = time.perf_counter()
+        normalized = normalize_image(
+            SimpleUploadedFile('photo.jpg', original, 'image/jpeg')
+        ).read()
+        normalize_time = time.perf_counter() - started
+        with tempfile.TemporaryDirectory() as directory:
+            storage = FileSystemStorage(directory)
+            self.stdout.write(
+                f'{"":<12}{"bytes":>12}{"thumbnails, ms":>16}'
+            )
+            for name, data in (('original', original),
+                               ('normalized', normalized)):
+                elapsed = min(
+                    self.render(storage, f'{name}.jpg', data)
+                    for _ in range(options['repeat'])
+                )
+                self.stdout.write(
+                    f'{name:<12}{len(data):>12}{elapsed * 1000:>16.0f}'
+                )
+        self.stdout.write(
+            f'Нормализация при загрузке: {normalize_time * 1000:.0f} ms'
+        )
+
+    @staticmethod
+    def camera_jpeg(width, height):
+        """Снимок с шумом, EXIF-поворотом и метаданными, как с камеры."""
+        noise = Image.effect_noise((width, height), 64)
+        image = Image.merge('RGB', (
+            noise, noise.rotate(90, expand=False), noise.transpose(
+                Image.FLIP_LEFT_RIGHT)
+        ))
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = 6
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=95, exif=exif.tobytes())
+        return output.getvalue()
+
+    @staticmethod
+    def render(storage, name, data):
+        """Все варианты POST_THUMBNAILS движком sorl, без хранилища KV."""
+        storage.save(name, io.BytesIO(data))
+        source = ImageFile(name, storage)
+        started = time.perf_counter()
+        for alias in settings.POST_THUMBNAILS:
+            for width, _, geometry, variant in thumbnail_variants(alias):
+                image = default.engine.get_image(source)
+                options = thumbnail_options(source, variant)
+                options['image_info'] = default.engine.get_image_info(image)
+                thumbnail = ImageFile(
+                    f'{os.path.splitext(name)[0]}_{width}'
+                    f'.{options["format"].lower()}', storage
+                )
+                default.backend._create_thumbnail(
+                    image, geometry, options, thumbnail
+                )
+        elapsed = time.perf_counter() - started
+        storage.delete(name)
+        return elapsed
@@ -0,0 +1,320 @@
+import json
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.models import Post
+from posts.thumbnails import (generate_thumbnails, thumbnail_names,
+                              thumbnails_ready)
+
+IMAGES_DIR = 'posts'
+
+
+def _scan_files(root, directory):
+    """Файлы каталога MEDIA_ROOT/directory: имя хранилища -> mtime."""
+    files = {}
+    for path, _, filenames in os.walk(os.path.join(root, directory)):
+        for filename in filenames:
+            full_path = os.path.join(path, filename)
+            name = os.path.relpath(full_path, root).replace(os.sep, '/')
+            files[name] = os.stat(full_path).st_mtime
+    return files
+
+
+def _expected_thumbnails(names):
+    return [thumbnail for name in names for thumbnail in thumbnail_names(name)]
+
+
+def _collect_shard(root, shard, expected, min_age, dry_run):
+    """Удаляет из шарда кэша миниатюры, которых не ждёт ни один пост."""
+    deadline = time.time() - min_age
+    deleted = 0
+    files = _scan_files(root, shard)
+    for name, mtime in files.items():
+        if name in expected or mtime > deadline:
+            continue
+        if not dry_run:
+            try:
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+        deleted += 1
+    return shard, len(files), deleted
+
+
+def _missing_files(root, items):
+    """Ключи KV, чьих файлов нет на диске."""
+    return [key for key, name in items
+            if not os.path.exists(os.path.join(root, name))]
+
+
+def _render(names, aliases):
+    close_old_connections()
+    failed = 0
+    for name in names:
+        try:
+            generate_thumbnails(name, aliases)
+            thumbnails_ready(name)
+        except Exception:
+            failed += 1
+    close_old_connections()
+    return len(names), failed
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживание миниатюр: удаляет осиротевшие файлы в media/cache '
+        'и устаревшие записи KV-хранилища sorl, заранее создаёт '
+        'миниатюры заданных геометрий для всех постов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gc', action='store_true',
+            help='Удалить осиротевшие миниатюры и записи KV-хранилища'
+        )
+        parser.add_argument(
+            '--render', nargs='*', metavar='ALIAS',
+            help='Создать миниатюры геометрий из POST_THUMBNAILS '
+                 '(без имён - всех)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов (0 - работать в текущем процессе)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument(
+            '--min-age', type=int, default=24 * 60 * 60,
+            help='Не удалять файлы моложе стольких секунд'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument(
+            '--state',
+            default=os.path.join(settings.BASE_DIR, '.thumbnails_state.json'),
+            help='Файл прогресса для продолжения прерванного запуска'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать заново, не читая файл прогресса'
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['render']
+        if aliases is not None:
+            unknown = set(aliases) - set(settings.POST_THUMBNAILS)
+            if unknown:
+                raise CommandError(
+                    f'Неизвестные геометрии: {", ".join(sorted(unknown))}'
+                )
+            aliases = sorted(aliases or settings.POST_THUMBNAILS)
+        if not options['gc'] and aliases is None:
+            raise CommandError('Укажите --gc и/или --render')
+        self.options = options
+        self.root = str(settings.MEDIA_ROOT)
+        self.state_path = options['state']
+        self.state = self.load_state({
+            'gc': options['gc'], 'render': aliases,
+            'dry_run': options['dry_run'],
+        })
+        self.names = sorted(set(
+            Post.objects.exclude(image='').values_list('image', flat=True)
+        ))
+        workers = options['workers']
+        if workers:
+            # Дочерние процессы открывают свои соединения с базой.
+            connections.close_all()
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork')
+            )
+        else:
+            self.executor = _InlineExecutor()
+        with self.executor:
+            if options['gc']:
+                self.collect_garbage()
+            if aliases is not None:
+                self.render(aliases)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def load_state(self, params):
+        if not self.options['restart'] and os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            if state.get('params') == params:
+                self.stdout.write('Продолжаем прерванный запуск')
+                return state
+        return {'params': params, 'done': {}}
+
+    def save_state(self):
+        temporary = self.state_path + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(temporary, self.state_path)
+
+    def done(self, phase):
+        return set(self.state['done'].setdefault(phase, []))
+
+    def mark_done(self, phase, item):
+        self.state['done'].setdefault(phase, []).append(item)
+        self.save_state()
+
+    def run(self, phase, jobs):
+        """Выполняет задачи {id: (функция, аргументы)} с прогрессом."""
+        finished = self.done(phase)
+        pending = {job_id: job for job_id, job in jobs.items()
+                   if job_id not in finished}
+        total = len(jobs)
+        futures = {
+            self.executor.submit(function, *args): job_id
+            for job_id, (function, args) in pending.items()
+        }
+        completed = total - len(pending)
+        for future in as_completed(futures):
+            result = future.result()
+            self.mark_done(phase, futures[future])
+            completed += 1
+            self.stdout.write(f'{phase}: {completed}/{total}')
+            yield result
+
+    def collect_garbage(self):
+        names = self.names
+        expected = set()
+        # Ожидаемые имена миниатюр нужны при каждом запуске, поэтому
+        # этот шаг не отмечается в файле прогресса.
+        for thumbnails in self.executor.map(
+            _expected_thumbnails, _chunks(names, self.options['chunk_size'])
+        ):
+            expected.update(thumbnails)
+
+        originals = self.scan_originals()
+        referenced = set(names)
+        self.stdout.write(
+            f'Оригиналов: {len(originals)}, без постов: '
+            f'{len(set(originals) - referenced)}, отсутствуют: '
+            f'{len(referenced - set(originals))}'
+        )
+
+        prefix = sorl_settings.THUMBNAIL_PREFIX.rstrip('/')
+        cache_dir = os.path.join(self.root, prefix)
+        shards = sorted(os.listdir(cache_dir)) if os.path.isdir(
+            cache_dir) else []
+        by_shard = {}
+        for name in expected:
+            by_shard.setdefault(name.rsplit('/', 2)[0], set()).add(name)
+        jobs = {}
+        for shard in shards:
+            shard = f'{prefix}/{shard}'
+            jobs[shard] = (_collect_shard, (
+                self.root, shard, by_shard.get(shard, set()),
+                self.options['min_age'], self.options['dry_run'],
+            ))
+        deleted = sum(result[2] for result in self.run('cache', jobs))
+        self.stdout.write(f'Удалено миниатюр: {deleted}')
+
+        if 'kvstore' not in self.done('kvstore'):
+            removed = self.collect_kvstore(referenced | expected)
+            self.stdout.write(f'Удалено записей KV: {removed}')
+            self.mark_done('kvstore', 'kvstore')
+
+    def scan_originals(self):
+        """Файлы media/posts: подкаталоги-шарды читаются параллельно."""
+        base = os.path.join(self.root, IMAGES_DIR)
+        if not os.path.isdir(base):
+            return {}
+        originals = {}
+        shards = []
+        for entry in os.scandir(base):
+            if entry.is_dir():
+                shards.append(f'{IMAGES_DIR}/{entry.name}')
+            else:
+                originals[f'{IMAGES_DIR}/{entry.name}'] = 0
+        for files in self.executor.map(
+            _scan_files, [self.root] * len(shards), shards
+        ):
+            originals.update(files)
+        return originals
+
+    def collect_kvstore(self, keep):
+        """Удаляет записи о файлах, которых нет или которые не нужны."""
+        image_prefix = add_prefix('', 'image')
+        stale = []
+        alive = []
+        rows = KVStoreModel.objects.filter(
+            key__startswith=image_prefix
+        ).values_list('key', 'value')
+        for key, value in rows.iterator():
+            name = deserialize(value)['name']
+            if name in keep:
+                alive.append((key, name))
+            else:
+                stale.append(key)
+        chunks = _chunks(alive, self.options['chunk_size'] * 10)
+        for missing in self.executor.map(
+            _missing_files, [self.root] * len(chunks), chunks
+        ):
+            stale.extend(missing)
+        if self.options['dry_run']:
+            return len(stale)
+        kvstore = default.kvstore
+        for batch in _chunks(stale, 500):
+            kvstore._delete_raw(*batch)
+        # Списки миниатюр оставляем только у живых картинок и только
+        # с живыми миниатюрами, как это делает KVStore.cleanup().
+        stale = {del_prefix(key) for key in stale}
+        thumbnails_prefix = add_prefix('', 'thumbnails')
+        rows = KVStoreModel.objects.filter(
+            key__startswith=thumbnails_prefix
+        ).values_list('key', 'value')
+        for key, value in rows.iterator():
+            source_key = del_prefix(key)
+            thumbnail_keys = deserialize(value)
+            live = [item for item in thumbnail_keys if item not in stale]
+            if source_key in stale or not live:
+                kvstore._delete(source_key, identity='thumbnails')
+            elif len(live) != len(thumbnail_keys):
+                kvstore._set(source_key, live, identity='thumbnails')
+        return len(stale)
+
+    def render(self, aliases):
+        chunks = _chunks(self.names, self.options['chunk_size'])
+        # Имена отсортированы, поэтому первое имя задаёт порцию и после
+        # перезапуска, если посты не менялись.
+        jobs = {chunk[0]: (_render, (chunk, aliases)) for chunk in chunks}
+        failed = sum(result[1] for result in self.run('render', jobs))
+        self.stdout.write(
+            f'Картинок: {len(self.names)}, с ошибками: {failed}'
+        )
+
+
+class _InlineExecutor:
+    """Исполнитель без процессов для --workers 0."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
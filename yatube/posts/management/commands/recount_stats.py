@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post, User, UserStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики постов, подписок и комментариев '
+        'пользователей и счётчики комментариев постов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько пользователей или постов пересчитывать '
+                 'за один проход'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(User.objects.values_list('id', flat=True))
+        for start in range(0, len(user_ids), batch_size):
+            UserStats.recount(user_ids[start:start + batch_size])
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        for start in range(0, len(post_ids), batch_size):
+            Post.objects.filter(
+                id__in=post_ids[start:start + batch_size]
+            ).recount_comments()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {len(user_ids)}, '
+            f'постов: {len(post_ids)}'
+        ))
@@ -0,0 +1,70 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:44
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    keep = Follow.objects.values('user_id', 'author_id').annotate(
+        first_id=models.Min('id')
+    ).values_list('first_id', flat=True)
+    duplicates = Follow.objects.exclude(id__in=list(keep))
+    pairs = list(duplicates.values_list('user_id', 'author_id'))
+    if not pairs:
+        return
+    duplicates.delete()
+    # 0009 посчитала дубликаты в счётчиках подписок, пересчитываем их
+    # у затронутых пользователей.
+    for field, lookup, user_ids in (
+        ('following_count', 'user', {user_id for user_id, _ in pairs}),
+        ('followers_count', 'author', {author_id for _, author_id in pairs}),
+    ):
+        follows = Follow.objects.filter(
+            **{lookup: models.OuterRef('user_id')}
+        ).order_by().values(lookup)
+        UserStats.objects.filter(user_id__in=user_ids).update(**{
+            field: Coalesce(
+                models.Subquery(
+                    follows.annotate(count=models.Count('id'))
+                    .values('count')
+                ),
+                0,
+            ),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_feeditem'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', 'author'], name='feed_user_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'], name='post_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='post_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='post_group_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObsoleteImage',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Добавлен')),
+            ],
+            options={
+                'verbose_name': 'Файл на удаление',
+                'verbose_name_plural': 'Файлы на удаление',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='obsoleteimage',
+            index=models.Index(fields=['created'], name='obsolete_created_idx'),
+        ),
+    ]
@@ -1,8 +1,18 @@
+import os
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
+# Длина начала текста поста в карточках лент.
+EXCERPT_LENGTH = 100
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -17,6 +27,40 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты: автор и группа одним JOIN, без лишних колонок.
+
+        Полный текст не читается: карточкам хватает excerpt.
+        """
+        return self.select_related('author', 'group').only(
+            'id', 'excerpt', 'pub_date', 'image',
+            'image_width', 'image_height', 'image_placeholder',
+            'comment_count', 'last_comment_at', 'version',
+            'author__id', 'author__username',
+            'author__first_name', 'author__last_name',
+            'group__id', 'group__slug', 'group__title',
+        )
+
+    def recount_comments(self):
+        """Пересчитывает comment_count и last_comment_at по комментариям."""
+        comments = Comment.objects.filter(
+            post=models.OuterRef('pk')
+        ).order_by().values('post')
+        return self.update(
+            comment_count=Coalesce(
+                models.Subquery(
+                    comments.annotate(count=models.Count('id'))
+                    .values('count')
+                ),
+                0,
+            ),
+            last_comment_at=models.Subquery(
+                comments.annotate(last=models.Max('created')).values('last')
+            ),
+        )
+
+
 class Post(models.Model):
     text = models.TextField(
         'Текст поста',
@@ -44,18 +88,100 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         help_text='Добавьте картинку'
     )
+    # Сведения о картинке заполняются при сохранении (posts.images),
+    # чтобы лента размечала картинки, не открывая файлы.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, blank=True, editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, blank=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки, байт', null=True, blank=True, editable=False
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки', blank=True, editable=False
+    )
+    # Счётчик и время последнего комментария обновляются сигналами
+    # комментариев, чтобы ленте не нужен был COUNT по комментариям.
+    comment_count = models.PositiveIntegerField(
+        'Комментариев', default=0, editable=False
+    )
+    last_comment_at = models.DateTimeField(
+        'Последний комментарий', null=True, blank=True, editable=False
+    )
+    # Начало текста для карточек заполняется при сохранении
+    # (posts.signals), чтобы лента не читала весь текст.
+    excerpt = models.CharField(
+        'Начало текста', max_length=EXCERPT_LENGTH, blank=True,
+        editable=False
+    )
+    # Версия содержимого страницы поста: растёт при правке поста, его
+    # группы, комментариев и готовности миниатюр, ключ кэша фрагментов.
+    version = models.PositiveIntegerField(
+        'Версия', default=0, editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+            # «Самые обсуждаемые»: order_by('-comment_count', '-id').
+            models.Index(
+                fields=['-comment_count', '-id'],
+                name='post_comment_count_idx'
+            ),
+        ]
+
+    # Поля, которые сигналы меняют атомарными UPDATE с F(): сохранение
+    # загруженного раньше поста не должно возвращать им старые значения.
+    SIGNAL_FIELDS = ('comment_count', 'last_comment_at', 'version')
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        # Копия (pk = None) и удалённый пост сохраняются вставкой.
+        if (update_fields is None and not force_insert
+                and self.pk is not None and not self._state.adding):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.SIGNAL_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class CommentQuerySet(models.QuerySet):
+    def for_list(self):
+        """Комментарии для вывода: автор одним JOIN, только нужные поля."""
+        return self.select_related('author').only(
+            'id', 'post_id', 'text', 'created',
+            'author__id', 'author__username',
+        )
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post,
@@ -69,9 +195,18 @@ class Comment(models.Model):
     created = models.DateTimeField('Дата публикации',
                                    auto_now_add=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
+        ordering = ('created', 'id')
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -94,7 +229,258 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
-        models.UniqueConstraint(
-            fields=['user', 'author'],
-            name='unique_follow'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_follow'
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые обновляются при записи."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь',
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+    def __str__(self):
+        return f'Статистика {self.user_id}'
+
+    @classmethod
+    def recount(cls, user_ids):
+        """Пересчитывает счётчики пользователей по данным таблиц."""
+        user_ids = list(user_ids)
+        sources = {
+            'posts_count': (Post, 'author_id'),
+            'followers_count': (Follow, 'author_id'),
+            'following_count': (Follow, 'user_id'),
+            'comments_count': (Comment, 'author_id'),
+        }
+        counts = {
+            field: dict(
+                model.objects.filter(**{f'{key}__in': user_ids})
+                .values_list(key).annotate(models.Count('id')).order_by()
+            )
+            for field, (model, key) in sources.items()
+        }
+        existing = set(
+            cls.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', flat=True)
+        )
+        stats = [
+            cls(user_id=user_id, **{
+                field: values.get(user_id, 0)
+                for field, values in counts.items()
+            })
+            for user_id in user_ids
+        ]
+        cls.objects.bulk_update(
+            [item for item in stats if item.user_id in existing],
+            list(counts)
+        )
+        cls.objects.bulk_create(
+            [item for item in stats if item.user_id not in existing]
+        )
+
+
+class FeedItem(models.Model):
+    """Строка материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Читатель',
+        related_name='feed_items'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='feed_items'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_item'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
+
+    @classmethod
+    def fan_out(cls, post):
+        """Раскладывает пост по лентам всех подписчиков автора."""
+        follower_ids = Follow.objects.filter(
+            author_id=post.author_id
+        ).values_list('user_id', flat=True)
+        cls.objects.bulk_create(
+            (
+                cls(user_id=user_id, post_id=post.pk,
+                    author_id=post.author_id, pub_date=post.pub_date)
+                for user_id in follower_ids.iterator()
+            ),
+            batch_size=500,
+            ignore_conflicts=True,
         )
+
+    @classmethod
+    def backfill(cls, user_id, author_id):
+        """Добавляет в ленту читателя все посты автора."""
+        posts = Post.objects.filter(author_id=author_id).values_list(
+            'id', 'pub_date'
+        )
+        cls.objects.bulk_create(
+            (
+                cls(user_id=user_id, post_id=post_id,
+                    author_id=author_id, pub_date=pub_date)
+                for post_id, pub_date in posts.iterator()
+            ),
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def backfill_followers(cls, author_id):
+        """Добавляет все посты автора в ленты всех его подписчиков.
+
+        Один INSERT ... SELECT в базе вместо вставки постов на каждого
+        подписчика: в Django нет вставки из запроса, поэтому SQL.
+        """
+        quote = connection.ops.quote_name
+        feed = quote(cls._meta.db_table)
+        follows = quote(Follow._meta.db_table)
+        posts = quote(Post._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {feed} (user_id, post_id, author_id, pub_date) '
+                f'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+                f'FROM {follows} f INNER JOIN {posts} p '
+                f'ON p.author_id = f.author_id '
+                f'WHERE f.author_id = %s AND NOT EXISTS ('
+                f'SELECT 1 FROM {feed} i '
+                f'WHERE i.user_id = f.user_id AND i.post_id = p.id)',
+                [author_id],
+            )
+
+
+class StoredImage(models.Model):
+    """Число постов, ссылающихся на файл картинки.
+
+    Одинаковые загрузки делят один файл, поэтому файл можно удалить
+    только вместе с последней ссылкой на него.
+    """
+    name = models.CharField('Файл', max_length=100, primary_key=True)
+    references = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return f'{self.name}: {self.references}'
+
+    @classmethod
+    def acquire(cls, name):
+        with transaction.atomic():
+            _, created = cls.objects.get_or_create(
+                name=name, defaults={'references': 1}
+            )
+            if not created:
+                cls.objects.filter(name=name).update(
+                    references=models.F('references') + 1
+                )
+
+    @classmethod
+    def release(cls, name):
+        """Снимает ссылку; возвращает True, если файл больше не нужен."""
+        with transaction.atomic():
+            cls.objects.filter(name=name, references__gt=0).update(
+                references=models.F('references') - 1
+            )
+            deleted, _ = cls.objects.filter(
+                name=name, references=0
+            ).delete()
+        return bool(deleted)
+
+
+class ObsoleteImage(models.Model):
+    """Файл картинки без ссылок, который ждёт удаления в фоне."""
+    name = models.CharField('Файл', max_length=100, primary_key=True)
+    created = models.DateTimeField('Добавлен', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Файл на удаление'
+        verbose_name_plural = 'Файлы на удаление'
+        indexes = [
+            models.Index(fields=['created'], name='obsolete_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Upload(models.Model):
+    """Картинка, которая загружается частями до создания поста.
+
+    Части дописываются в файл UPLOAD_DIR/<token>.part; после последней
+    части проверяется SHA-256, и PostForm может взять файл по токену.
+    """
+    token = models.UUIDField(
+        'Токен', primary_key=True, default=uuid.uuid4, editable=False
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='uploads'
+    )
+    filename = models.CharField('Имя файла', max_length=100)
+    size = models.PositiveIntegerField('Размер, байт')
+    checksum = models.CharField('SHA-256', max_length=64)
+    received = models.PositiveIntegerField('Получено, байт', default=0)
+    complete = models.BooleanField('Завершена', default=False)
+    created = models.DateTimeField('Начата', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Загрузка'
+        verbose_name_plural = 'Загрузки'
+
+    def __str__(self):
+        return f'{self.filename}: {self.received}/{self.size}'
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_DIR, f'{self.token}.part')
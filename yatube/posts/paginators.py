@@ -0,0 +1,244 @@
+import base64
+
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .caching import get_version
+
+COUNT_KEY = 'count:{}:{}'
+
+# Верхняя граница id в курсоре: больше не вмещает целое SQLite.
+MAX_ID = 2 ** 63
+
+
+def encode_cursor(obj, date_field='pub_date'):
+    """Кодирует позицию объекта (дата, id) в непрозрачный токен."""
+    raw = f'{getattr(obj, date_field).isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает пару (pub_date, id) или None, если токен испорчен.
+
+    Токен приходит от клиента: дата без часового пояса не сравнивается
+    с датами постов, а id вне 64-битного целого не принимает SQLite.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        pub_date, pk = raw.rsplit('|', 1)
+        pub_date, pk = datetime.fromisoformat(pub_date), int(pk)
+    except ValueError:
+        return None
+    if pub_date.tzinfo is None or not 0 < pk < MAX_ID:
+        return None
+    return pub_date, pk
+
+
+def keyset_q(key_fields, lookup, cursor):
+    """Условие «строго после/до курсора» для пары полей (дата, id)."""
+    date_field, id_field = key_fields
+    pub_date, pk = cursor
+    return (
+        Q(**{f'{date_field}__{lookup}': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__{lookup}': pk})
+    )
+
+
+class PageCursor:
+    """Курсоры соседних страниц для ссылок «Предыдущая»/«Следующая»."""
+
+    def __init__(self, page, keyset=False, has_next=None, has_previous=None):
+        self.page = page
+        self.keyset = keyset
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    @cached_property
+    def has_next(self):
+        if self._has_next is None:
+            return self.page.has_next()
+        return self._has_next
+
+    @cached_property
+    def has_previous(self):
+        if self._has_previous is None:
+            return self.page.has_previous()
+        return self._has_previous
+
+    @cached_property
+    def next(self):
+        if not self.has_next or not len(self.page):
+            return ''
+        return encode_cursor(self.page[len(self.page) - 1])
+
+    @cached_property
+    def previous(self):
+        if not self.has_previous or not len(self.page):
+            return ''
+        return encode_cursor(self.page[0])
+
+
+class CursorPaginator(Paginator):
+    """Paginator с поддержкой постраничного вывода по ключу (pub_date, id).
+
+    Страницы по курсору не требуют COUNT(*) и OFFSET, поэтому их
+    стоимость не зависит от глубины. Обычные страницы ?page=N
+    по-прежнему доступны через get_page().
+    """
+
+    def __init__(self, object_list, per_page, **kwargs):
+        object_list = object_list.order_by('-pub_date', '-id')
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _get_page(self, *args, **kwargs):
+        page = super()._get_page(*args, **kwargs)
+        page.cursor = PageCursor(page)
+        return page
+
+    def fetch_rows(self, limit, after=None, before=None):
+        """Посты после after (по убыванию) или перед before.
+
+        Посты перед before идут по возрастанию.
+        """
+        if before is not None:
+            queryset = self.object_list.filter(
+                keyset_q(('pub_date', 'id'), 'gt', before)
+            ).order_by('pub_date', 'id')
+        elif after is not None:
+            queryset = self.object_list.filter(
+                keyset_q(('pub_date', 'id'), 'lt', after)
+            )
+        else:
+            queryset = self.object_list
+        return list(queryset[:limit])
+
+    def keyset_page(self, after=None, before=None):
+        """Возвращает страницу после курсора after или перед before."""
+        if before is not None:
+            rows = self.fetch_rows(self.per_page + 1, before=before)
+            if len(rows) <= self.per_page:
+                # Впереди меньше целой страницы: это и есть первая страница.
+                return self.keyset_page()
+            rows = rows[:self.per_page][::-1]
+            return self._keyset_page(rows, has_next=True, has_previous=True)
+        rows = self.fetch_rows(self.per_page + 1, after=after)
+        return self._keyset_page(
+            rows[:self.per_page],
+            has_next=len(rows) > self.per_page,
+            has_previous=after is not None,
+        )
+
+    def _keyset_page(self, rows, has_next, has_previous):
+        page = Page(rows, None if has_previous else 1, self)
+        page.cursor = PageCursor(
+            page, keyset=True, has_next=has_next, has_previous=has_previous
+        )
+        return page
+
+    def get_cursor_page(self, after_token=None, before_token=None):
+        return self.keyset_page(
+            after=decode_cursor(after_token),
+            before=decode_cursor(before_token),
+        )
+
+
+class CachedCountPaginator(CursorPaginator):
+    """Paginator с кэшированным числом записей и сокращённой навигацией.
+
+    Число записей хранится в кэше под версией области count_scope
+    (лента, группа, автор, подписчик), поэтому сбрасывается сигналами
+    записи без явного удаления ключей. Номера страниц выводятся окном
+    вокруг текущей, так что навигация не растёт с числом страниц.
+    """
+
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, count_scope=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_scope = count_scope
+
+    def compute_count(self):
+        return self.object_list.count()
+
+    @cached_property
+    def count(self):
+        if self.count_scope is None:
+            return self.compute_count()
+        key = COUNT_KEY.format(self.count_scope, get_version(self.count_scope))
+        count = cache.get(key)
+        if count is None:
+            count = self.compute_count()
+            cache.set(key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+        return count
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Номера страниц: края и окно вокруг number, пропуски - ELLIPSIS."""
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+    def _get_page(self, *args, **kwargs):
+        page = super()._get_page(*args, **kwargs)
+        page.elided_page_range = list(
+            self.get_elided_page_range(page.number)
+        )
+        return page
+
+
+class FollowFeedPaginator(CachedCountPaginator):
+    """Лента подписок: курсорные страницы собирает FollowFeed.
+
+    Режим ?page=N считает страницы по обычному запросу object_list,
+    а число постов берёт из счётчиков авторов. Счётчик подписчика
+    сбрасывается при подписке и отписке, новые посты авторов он
+    учитывает не позже чем через PAGINATOR_COUNT_TIMEOUT.
+    """
+
+    def __init__(self, object_list, per_page, feed, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.feed = feed
+
+    def compute_count(self):
+        return self.feed.count()
+
+    def fetch_rows(self, limit, after=None, before=None):
+        return self.feed.posts(limit, after=after, before=before)
+
+
+def comments_page(comments, after_token=None, per_page=None):
+    """Порция комментариев по возрастанию (created, id) после курсора.
+
+    Возвращает список комментариев и курсор следующей порции ('' -
+    комментариев больше нет). Глубина не влияет на стоимость запроса.
+    """
+    per_page = per_page or settings.COMMENTS_PER_PAGE
+    comments = comments.for_list().order_by('created', 'id')
+    after = decode_cursor(after_token)
+    if after is not None:
+        comments = comments.filter(keyset_q(('created', 'id'), 'gt', after))
+    rows = list(comments[:per_page + 1])
+    if len(rows) <= per_page:
+        return rows, ''
+    return rows[:per_page], encode_cursor(rows[per_page - 1], 'created')
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .background import BackgroundJob
+from .images import EXTENSIONS, SAVE_OPTIONS
+from .models import Post
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки только внутри процесса.
+    fcntl = None
+
+SALT = 'posts.resize'
+
+FORMATS = {extension: image_format
+           for image_format, extension in EXTENSIONS.items()}
+FORMATS['.jpeg'] = 'JPEG'
+
+# Время последнего чтения (mtime файла) обновляется не чаще раза
+# в столько секунд.
+ACCESS_RESOLUTION = 60
+
+# Вытеснение запускается в фоне, когда процесс записал столько от
+# предела, и освобождает место до LOW_WATERMARK от предела.
+EVICT_EVERY = 0.05
+LOW_WATERMARK = 0.9
+
+LOCK_FILE = '.lock'
+
+_key_locks = [threading.Lock() for _ in range(64)]
+_evict_lock = threading.Lock()
+_written = 0
+_written_lock = threading.Lock()
+
+
+def resize_url(name, width, height, crop=False, image_format=None):
+    """Подписанный адрес картинки name, вписанной в width x height.
+
+    С crop=True картинка обрезается по центру точно до width x height.
+    Формат по умолчанию - формат оригинала по расширению.
+    """
+    if image_format is None:
+        extension = os.path.splitext(name)[1].lower()
+        image_format = FORMATS.get(extension, 'JPEG')
+    params = {'n': name, 'w': width, 'h': height, 'c': bool(crop),
+              'f': image_format}
+    return reverse('posts:resize_image', args=[
+        signing.dumps(params, salt=SALT, compress=True)
+    ])
+
+
+def load_params(signed):
+    """Проверяет подпись и параметры; ValueError или BadSignature."""
+    params = signing.loads(signed, salt=SALT)
+    if not isinstance(params, dict):
+        raise ValueError('Неверные параметры')
+    width, height = params.get('w'), params.get('h')
+    for side in (width, height):
+        if not isinstance(side, int) or not (
+                0 < side <= settings.RESIZE_MAX_SIDE):
+            raise ValueError(f'Неверный размер {side}')
+    if params.get('f') not in EXTENSIONS:
+        raise ValueError(f'Неверный формат {params.get("f")}')
+    if not isinstance(params.get('n'), str):
+        raise ValueError('Неверное имя файла')
+    return params
+
+
+def cache_path(params):
+    """Файл результата в шардированном кэше: ab/cd/<sha256>.<ext>."""
+    key = hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode()
+    ).hexdigest()
+    return os.path.join(
+        settings.RESIZE_CACHE_DIR, key[:2], key[2:4],
+        key + EXTENSIONS[params['f']],
+    )
+
+
+def _touch(path):
+    """Отмечает чтение файла; False, если файла нет."""
+    try:
+        accessed = os.stat(path).st_mtime
+        if time.time() - accessed > ACCESS_RESOLUTION:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@contextmanager
+def _key_lock(path):
+    """Блокировка ключа между потоками и процессами.
+
+    Файл блокировки общий для шарда, чтобы файлы блокировок не
+    копились: ключи одного шарда в редких случаях ждут друг друга.
+    """
+    directory = os.path.dirname(path)
+    with _key_locks[hash(path) % len(_key_locks)]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _render(params, path):
+    width, height = params['w'], params['h']
+    storage = Post._meta.get_field('image').storage
+    with storage.open(params['n'], 'rb') as source:
+        image = Image.open(source)
+        if image.width * image.height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValueError(f'Картинка {params["n"]} слишком большая')
+        image.draft('RGB', (width, height))
+        image = ImageOps.exif_transpose(image)
+        if params['c']:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+    image_format = params['f']
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.info = {}
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Запись во временный файл и переименование: читатели никогда не
+    # видят недописанную картинку.
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            image.save(output, image_format, **SAVE_OPTIONS[image_format])
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return os.path.getsize(path)
+
+
+def open_resized(params):
+    """Открывает картинку по проверенным параметрам, создавая её.
+
+    Одну картинку одновременно создаёт только один запрос, остальные
+    ждут его и читают готовый файл.
+    """
+    path = cache_path(params)
+    if not _touch(path):
+        with _key_lock(path):
+            if not _touch(path):
+                _written_bytes(_render(params, path))
+    return open(path, 'rb')
+
+
+def _written_bytes(size):
+    global _written
+    max_size = settings.RESIZE_CACHE_MAX_SIZE
+    with _written_lock:
+        _written += size
+        if _written < max_size * EVICT_EVERY:
+            return
+        _written = 0
+    # Вытеснение обходит весь кэш и не должно задерживать запрос.
+    _evict_job.schedule()
+
+
+def evict(max_size=None):
+    """Удаляет давно не читанные файлы, пока кэш больше предела.
+
+    Возвращает число удалённых файлов. Если вытеснение уже идёт
+    в другом потоке или процессе, ничего не делает.
+    """
+    if max_size is None:
+        max_size = settings.RESIZE_CACHE_MAX_SIZE
+    root = settings.RESIZE_CACHE_DIR
+    if not _evict_lock.acquire(blocking=False):
+        return 0
+    try:
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0
+            return _evict(root, max_size)
+    finally:
+        _evict_lock.release()
+
+
+_evict_job = BackgroundJob(
+    'resize-evict', evict, 'Не удалось очистить кэш картинок'
+)
+
+
+def _scan(root):
+    """Файлы кэша (время чтения, размер, путь) и их общий размер."""
+    files = []
+    total = 0
+    for path, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename == LOCK_FILE or filename.endswith('.tmp'):
+                continue
+            full_path = os.path.join(path, filename)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, full_path))
+            total += stat.st_size
+    return files, total
+
+
+def _evict(root, max_size):
+    files, total = _scan(root)
+    if total <= max_size:
+        return 0
+    deleted = 0
+    for _, size, full_path in sorted(files):
+        if total <= max_size * LOW_WATERMARK:
+            break
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted
@@ -0,0 +1,341 @@
+import threading
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (Case, DateTimeField, F, IntegerField, Subquery,
+                              Value, When)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils.text import Truncator
+
+from .caching import (FEED, author_scope, bump_versions, follower_scope,
+                      group_scope, post_scope)
+from .feeds import forget_recent_posts, is_pull_author
+from .images import image_metadata, release_image
+from .models import (EXCERPT_LENGTH, Comment, FeedItem, Follow, Group, Post,
+                     StoredImage, Upload, User, UserStats)
+from .uploads import delete_upload_file
+
+
+class _Cascade(threading.local):
+    """Что удаляется в текущем потоке.
+
+    Django шлёт pre_delete для всех объектов каскада раньше первого
+    post_delete, поэтому в pre_delete удаление запоминается, а в
+    post_delete обрабатывается сразу для всего каскада.
+    """
+
+    def __init__(self):
+        self.posts = set()
+        self.comment_authors = {}
+
+
+_cascade = _Cascade()
+
+
+def change_stats(user_id, field, delta):
+    """Атомарно сдвигает счётчик пользователя на delta."""
+    with transaction.atomic():
+        updated = UserStats.objects.filter(user_id=user_id).update(
+            **{field: F(field) + delta}
+        )
+        if not updated and delta > 0:
+            UserStats.recount([user_id])
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+# Поля автора в карточках и на страницах постов, закэшированных по
+# версии поста.
+AUTHOR_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_user(sender, instance, raw=False, update_fields=None,
+                           **kwargs):
+    instance._previous_names = None
+    if raw or instance.pk is None or (
+            update_fields is not None
+            and not set(AUTHOR_FIELDS) & set(update_fields)):
+        return
+    instance._previous_names = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def author_renamed(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_names', None)
+    current = tuple(getattr(instance, field) for field in AUTHOR_FIELDS)
+    if created or raw or previous is None or previous == current:
+        return
+    posts = Post.objects.filter(author_id=instance.pk)
+    posts.update(version=F('version') + 1)
+    group_ids = posts.exclude(group=None).order_by().values_list(
+        'group_id', flat=True).distinct()
+    # Имя комментатора закэшировано в списках комментариев чужих постов.
+    commented_ids = set(Comment.objects.filter(
+        author_id=instance.pk
+    ).values_list('post_id', flat=True))
+    Post.objects.filter(pk__in=commented_ids).update(
+        version=F('version') + 1
+    )
+    bump_versions(FEED, author_scope(instance.pk),
+                  *map(group_scope, group_ids),
+                  *map(post_scope, commented_ids))
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_stats(instance.author_id, 'posts_count', 1)
+        if not is_pull_author(instance.author_id):
+            FeedItem.fan_out(instance)
+        forget_recent_posts(instance.author_id)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    _cascade.posts.add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    _cascade.posts.discard(instance.pk)
+    change_stats(instance.author_id, 'posts_count', -1)
+    forget_recent_posts(instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_post(sender, instance, raw=False, **kwargs):
+    # При переносе поста в другую группу меняются обе страницы групп,
+    # при замене картинки освобождается ссылка на старый файл.
+    instance._previous_group_id = None
+    instance._previous_image = ''
+    if instance.pk and not raw:
+        previous = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image'
+        ).first()
+        if previous:
+            instance._previous_group_id, instance._previous_image = previous
+
+
+@receiver(pre_save, sender=Post)
+def fill_image_metadata(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    image = instance.image
+    if image._committed and image.name == instance._previous_image:
+        return
+    for field, value in image_metadata(image).items():
+        setattr(instance, field, value)
+
+
+@receiver(pre_save, sender=Post)
+def fill_excerpt(sender, instance, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and 'text' not in update_fields:
+        return
+    instance.excerpt = Truncator(instance.text).chars(EXCERPT_LENGTH)
+    if update_fields is not None and 'excerpt' not in update_fields:
+        # update_fields не расширить из сигнала, начало пишется отдельно.
+        Post.objects.filter(pk=instance.pk).update(excerpt=instance.excerpt)
+
+
+@receiver(post_save, sender=Post)
+def post_image_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_image', '')
+    current = instance.image.name or ''
+    if previous == current:
+        return
+    if current:
+        StoredImage.acquire(current)
+    if previous:
+        release_image(previous)
+
+
+@receiver(post_delete, sender=Post)
+def post_image_deleted(sender, instance, **kwargs):
+    if instance.image:
+        release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+def bump_post_version(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    # Атомарно: версию параллельно поднимают и комментарии.
+    Post.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+    instance.version += 1
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = {FEED, author_scope(instance.author_id),
+              post_scope(instance.pk)}
+    for group_id in (instance.group_id,
+                     getattr(instance, '_previous_group_id', None)):
+        if group_id:
+            scopes.add(group_scope(group_id))
+    bump_versions(*scopes)
+
+
+def touch_group_posts(group_id):
+    """Поднимает версии постов группы и возвращает id их авторов.
+
+    Название и ссылка группы закэшированы в страницах постов по версии.
+    """
+    posts = Post.objects.filter(group_id=group_id)
+    posts.update(version=F('version') + 1)
+    return set(
+        posts.order_by().values_list('author_id', flat=True).distinct()
+    )
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # После удаления посты отвязываются от группы (SET_NULL) без
+    # сигналов сохранения, и найти их уже нельзя.
+    instance._author_ids = touch_group_posts(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    author_ids = getattr(instance, '_author_ids', None)
+    if author_ids is None:
+        author_ids = touch_group_posts(instance.pk)
+    # Название группы выводится и в карточках постов на страницах авторов.
+    bump_versions(FEED, group_scope(instance.pk),
+                  *map(author_scope, author_ids))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comments_changed(sender, instance, raw=False, created=True, **kwargs):
+    if raw or instance.post_id in _cascade.posts:
+        # Удаляемый пост сам поднимет версии своих страниц и лент.
+        return
+    scopes = {post_scope(instance.post_id)}
+    if created:
+        # Число комментариев выводится в карточках всех лент поста.
+        if Comment._meta.get_field('post').is_cached(instance):
+            post = instance.post
+        else:
+            post = Post.objects.filter(pk=instance.post_id).only(
+                'author_id', 'group_id'
+            ).first()
+        if post is not None:
+            scopes.update((FEED, author_scope(post.author_id)))
+            if post.group_id:
+                scopes.add(group_scope(post.group_id))
+    bump_versions(*scopes)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def followers_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions(author_scope(instance.author_id),
+                      follower_scope(instance.user_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    posts = Post.objects.filter(pk=instance.post_id)
+    if not created:
+        posts.update(version=F('version') + 1)
+        return
+    change_stats(instance.author_id, 'comments_count', 1)
+    created_at = Value(instance.created, output_field=DateTimeField())
+    # Greatest: комментарии могут зафиксироваться не по порядку.
+    posts.update(
+        comment_count=F('comment_count') + 1,
+        last_comment_at=Coalesce(
+            Greatest('last_comment_at', created_at), created_at
+        ),
+        version=F('version') + 1,
+    )
+
+
+@receiver(pre_delete, sender=Comment)
+def comment_deleting(sender, instance, **kwargs):
+    _cascade.comment_authors[instance.pk] = instance.author_id
+
+
+def release_comment_stats():
+    """Одним UPDATE снимает со счётчиков авторов удалённые комментарии."""
+    deleted = Counter(_cascade.comment_authors.values())
+    _cascade.comment_authors.clear()
+    if not deleted:
+        return
+    UserStats.objects.filter(user_id__in=deleted).update(
+        comments_count=F('comments_count') - Case(
+            *(When(user_id=user_id, then=Value(count))
+              for user_id, count in deleted.items()),
+            output_field=IntegerField(),
+        )
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    release_comment_stats()
+    if instance.post_id in _cascade.posts:
+        return
+    last_comment = Comment.objects.filter(
+        post_id=instance.post_id
+    ).order_by('-created').values('created')[:1]
+    Post.objects.filter(pk=instance.post_id).update(
+        comment_count=Greatest(F('comment_count') - 1, Value(0)),
+        last_comment_at=Subquery(last_comment),
+        version=F('version') + 1,
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_stats(instance.author_id, 'followers_count', 1)
+        change_stats(instance.user_id, 'following_count', 1)
+        if not is_pull_author(instance.author_id):
+            FeedItem.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    change_stats(instance.author_id, 'followers_count', -1)
+    change_stats(instance.user_id, 'following_count', -1)
+    FeedItem.objects.filter(
+        user_id=instance.user_id, author_id=instance.author_id
+    ).delete()
+    became_pushed = UserStats.objects.filter(
+        user_id=instance.author_id,
+        followers_count=settings.FEED_PUSH_MAX_FOLLOWERS,
+    ).exists()
+    if became_pushed:
+        # Автор вернулся под порог: его посты снова раскладываются
+        # по лентам, поэтому дозаполняем ленты текущих подписчиков.
+        FeedItem.backfill_followers(instance.author_id)
+
+
+@receiver(post_delete, sender=Upload)
+def upload_deleted(sender, instance, **kwargs):
+    delete_upload_file(instance.path)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, которое называет файлы по SHA-256 содержимого.
+
+    posts/photo.jpg сохраняется как posts/ab/<sha256>.jpg. Одинаковые
+    загрузки получают одно имя, поэтому делят один файл и один набор
+    миниатюр sorl; повторная запись не выполняется.
+    """
+
+    # Права файлов по умолчанию, как у FILE_UPLOAD_PERMISSIONS в новых
+    # версиях Django: временный файл создаётся с 0o600.
+    DEFAULT_FILE_MODE = 0o644
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Имя задаёт содержимое: файл с этим именем - тот же файл.
+        return name
+
+    def _save(self, name, content):
+        """Записывает файл целиком во временный и публикует link().
+
+        Если одинаковые загрузки пришли одновременно, link() второй из
+        них находит готовый файл, и это тоже успешное сохранение.
+        """
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            mode = self.file_permissions_mode
+            os.chmod(temporary,
+                     self.DEFAULT_FILE_MODE if mode is None else mode)
+            try:
+                os.link(temporary, full_path)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(temporary)
+        return name.replace('\\', '/')
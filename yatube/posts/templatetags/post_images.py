@@ -0,0 +1,28 @@
+from django import template
+
+from ..resize import resize_url
+from ..thumbnails import prefetch_thumbnails
+
+register = template.Library()
+
+
+@register.filter
+def post_thumbnail(post, alias):
+    # Страницы ленты раскладывают миниатюры заранее в paginator_view.
+    if not hasattr(post, 'thumbnails'):
+        prefetch_thumbnails([post])
+    return post.thumbnails.get(alias)
+
+
+@register.filter
+def resized(image, size):
+    """Адрес картинки нужного размера: {{ post.image|resized:"320x240" }}.
+
+    С суффиксом "crop" ("320x240crop") картинка обрезается точно до
+    размера, иначе вписывается в него.
+    """
+    if not image:
+        return ''
+    crop = size.endswith('crop')
+    width, height = size[:-4 if crop else None].split('x')
+    return resize_url(image.name, int(width), int(height), crop=crop)
@@ -81,7 +81,11 @@ class PostCreateFormTests(TestCase):
 
         self.assertEqual(Post.objects.first().text, form_data['text'])
         self.assertEqual(Post.objects.first().group.id, form_data['group'])
-        self.assertEqual(Post.objects.first().image, 'posts/small.gif')
+        # Файл назван по SHA-256 содержимого, см. ContentAddressedStorage.
+        self.assertRegex(
+            Post.objects.first().image.name,
+            r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.gif$'
+        )
 
     def test_edit_form_works_correct(self):
         """Форма редактирования поста работает корректно, пост меняется."""
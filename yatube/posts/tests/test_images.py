@@ -0,0 +1,589 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from .. import resize
+from ..background import BackgroundJob, get_executor
+from ..forms import PostForm
+from ..images import delete_obsolete_images
+from ..models import ObsoleteImage, Post, StoredImage, User
+from ..thumbnails import (generate_thumbnails, prefetch_thumbnails,
+                          thumbnail_names)
+
+TEMP_ROOT = settings.BASE_DIR + os.sep + "temp"
+os.makedirs(TEMP_ROOT, exist_ok=True)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=TEMP_ROOT)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def upload(self, name='small.gif'):
+        return SimpleUploadedFile(
+            name=name, content=SMALL_GIF, content_type='image/gif'
+        )
+
+    def test_post_create_schedules_thumbnails(self):
+        """После создания поста миниатюры ставятся в очередь."""
+        with mock.patch('posts.views.schedule_thumbnails') as schedule:
+            self.client.post(
+                reverse('posts:post_create'),
+                {'text': 'Пост', 'image': self.upload()},
+            )
+        post = Post.objects.get()
+        schedule.assert_called_once_with(post.image.name)
+
+    def test_text_edit_keeps_thumbnails(self):
+        """Правка текста не ставит миниатюры прежней картинки в очередь."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=self.upload()
+        )
+        url = reverse('posts:post_edit', args=[post.pk])
+        with mock.patch('posts.views.schedule_thumbnails') as schedule:
+            self.client.post(url, {'text': 'Новый текст'})
+            schedule.assert_not_called()
+            self.client.post(
+                url, {'text': 'Новый текст', 'image': self.upload('new.gif')}
+            )
+        post.refresh_from_db()
+        schedule.assert_called_once_with(post.image.name)
+
+    def test_pending_thumbnail_falls_back_to_original(self):
+        """Пока миниатюры нет, шаблон получает оригинал без ресайза."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=self.upload()
+        )
+        with mock.patch('posts.thumbnails.get_thumbnail') as get_thumbnail:
+            prefetch_thumbnails([post])
+        get_thumbnail.assert_not_called()
+        self.assertEqual(post.thumbnails['card'].url, post.image.url)
+
+        generate_thumbnails(post.image.name)
+        thumbnail = prefetch_thumbnails([post])[0].thumbnails['card']
+        self.assertNotEqual(thumbnail.url, post.image.url)
+        self.assertEqual((thumbnail.width, thumbnail.height), (960, 339))
+
+    def test_responsive_variants(self):
+        """Карточка получает WebP и запасной формат во всех ширинах."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=self.upload()
+        )
+        generate_thumbnails(post.image.name)
+        image = prefetch_thumbnails([post])[0].thumbnails['card']
+        widths = [f'{width}w' for width in settings.POST_THUMBNAIL_WIDTHS]
+        for srcset, extension in ((image.srcset, '.gif'),
+                                  (image.webp_srcset, '.webp')):
+            entries = srcset.split(', ')
+            self.assertEqual([entry.split()[1] for entry in entries], widths)
+            for entry in entries:
+                self.assertTrue(entry.split()[0].endswith(extension))
+        self.assertTrue(image.url.endswith('.gif'))
+
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="960" height="339"')
+
+    def test_page_thumbnails_fetched_in_one_batch(self):
+        """Миниатюры страницы читаются одним get_many и одним запросом."""
+        posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=self.user, image=self.upload()
+            )
+            for i in range(3)
+        ]
+        for post in posts:
+            generate_thumbnails(post.image.name)
+        cache.clear()
+        kv_cache = default.kvstore.cache
+        with mock.patch.object(
+            kv_cache, 'get_many', wraps=kv_cache.get_many
+        ) as get_many, CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        sorl_calls = [call for call in get_many.call_args_list
+                      if any('sorl-thumbnail' in key for key in call[0][0])]
+        self.assertEqual(len(sorl_calls), 1)
+        self.assertEqual(
+            len([query for query in queries
+                 if 'thumbnail_kvstore' in query['sql']]), 1
+        )
+        for post in response.context['page_obj']:
+            self.assertIn('/cache/', post.thumbnails['card'].url)
+
+    def test_missing_file_does_not_break_page(self):
+        """Пост с отсутствующим файлом картинки открывается."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image='posts/missing.jpg'
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class NormalizeImageTests(TestCase):
+    """Нормализация картинки при загрузке через PostForm."""
+
+    @staticmethod
+    def jpeg(size, orientation=None):
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        exif[0x010F] = 'Camera'
+        output = io.BytesIO()
+        Image.new('RGB', size, 'red').save(
+            output, 'JPEG', exif=exif.tobytes()
+        )
+        return SimpleUploadedFile('photo.jpg', output.getvalue(),
+                                  'image/jpeg')
+
+    def clean(self, upload):
+        form = PostForm({'text': 'Пост'}, {'image': upload})
+        form.is_valid()
+        return form
+
+    def test_orientation_applied_and_metadata_stripped(self):
+        """EXIF-поворот применяется к пикселям, метаданные удаляются."""
+        form = self.clean(self.jpeg((40, 20), orientation=6))
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.size, (20, 40))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertFalse(image.getexif())
+
+    @override_settings(POST_IMAGE_MAX_SIDE=30)
+    def test_large_original_downscaled(self):
+        """Оригинал больше предела уменьшается с сохранением пропорций."""
+        form = self.clean(self.jpeg((90, 60)))
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.size, (30, 20))
+        self.assertEqual(form.cleaned_data['image'].name, 'photo.jpg')
+
+    def test_limits(self):
+        """Слишком тяжёлые и слишком большие картинки отклоняются."""
+        limits = {
+            'POST_IMAGE_MAX_BYTES': 100,
+            'POST_IMAGE_MAX_PIXELS': 100,
+        }
+        for setting, value in limits.items():
+            with self.subTest(setting=setting):
+                with self.settings(**{setting: value}):
+                    form = self.clean(self.jpeg((40, 20)))
+                self.assertIn('image', form.errors)
+
+    def test_truncated_jpeg_rejected(self):
+        """Обрезанный JPEG - ошибка формы, а не исключение."""
+        upload = self.jpeg((400, 300))
+        truncated = SimpleUploadedFile(
+            'photo.jpg', upload.read()[:upload.size // 2], 'image/jpeg'
+        )
+        form = self.clean(truncated)
+        self.assertEqual(form.errors['image'], ['Картинка повреждена.'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageMetadataTests(TestCase):
+    """Размеры и заглушка картинки сохраняются в посте."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    def create_post(self, image):
+        return Post.objects.create(text='Пост', author=self.user,
+                                   image=image)
+
+    def test_metadata_saved_with_image(self):
+        post = self.create_post(NormalizeImageTests.jpeg((40, 20), 6))
+        post.refresh_from_db()
+        # Размеры - как картинку видит браузер, с учётом EXIF-поворота.
+        self.assertEqual((post.image_width, post.image_height), (20, 40))
+        self.assertEqual(post.image_size, post.image.size)
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertContains(response, post.image_placeholder)
+
+        post.image = ''
+        post.save()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_placeholder, '')
+
+    def test_missing_file_saved_without_metadata(self):
+        post = self.create_post('posts/missing.jpg')
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_placeholder, '')
+
+    def test_backfill_command(self):
+        first = self.create_post(SimpleUploadedFile(
+            'small.gif', SMALL_GIF, 'image/gif'
+        ))
+        second = self.create_post(first.image.name)
+        missing = self.create_post('posts/missing.jpg')
+        Post.objects.update(image_width=None, image_height=None,
+                            image_size=None, image_placeholder='')
+
+        output = io.StringIO()
+        call_command('fill_image_metadata', stdout=output)
+        self.assertIn('Заполнено постов: 2, не прочитано картинок: 1',
+                      output.getvalue())
+        for post in (first, second):
+            post.refresh_from_db()
+            self.assertEqual((post.image_width, post.image_height), (2, 1))
+            self.assertTrue(post.image_placeholder)
+        missing.refresh_from_db()
+        self.assertIsNone(missing.image_width)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   POST_IMAGE_CLEANUP_IN_BACKGROUND=False)
+class DeduplicatedStorageTests(TransactionTestCase):
+    """Одинаковые загрузки делят файл, он удаляется с последним постом."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author')
+        cache.clear()
+
+    def create_post(self):
+        upload = SimpleUploadedFile(
+            name='small.gif', content=SMALL_GIF, content_type='image/gif'
+        )
+        return Post.objects.create(text='Пост', author=self.user,
+                                   image=upload)
+
+    def test_identical_uploads_share_file(self):
+        first, second = self.create_post(), self.create_post()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(StoredImage.objects.get(name=name).references, 2)
+        storage = first.image.storage
+
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=name).references, 1)
+
+        second.delete()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+
+    def test_concurrent_identical_saves_share_file(self):
+        """Одновременная запись того же содержимого не создаёт копию."""
+        storage = Post._meta.get_field('image').storage
+        # exists() проверен обеими загрузками до записи файла.
+        with mock.patch.object(storage, 'exists', return_value=False):
+            names = {storage.save('posts/small.gif', ContentFile(SMALL_GIF))
+                     for _ in range(2)}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        directory = os.path.dirname(storage.path(name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(name)])
+        with storage.open(name) as file:
+            self.assertEqual(file.read(), SMALL_GIF)
+        storage.delete(name)
+
+    def test_replaced_image_released(self):
+        post = self.create_post()
+        name = post.image.name
+        post.image = 'posts/other.gif'
+        post.save()
+        self.assertFalse(post.image.storage.exists(name))
+        self.assertEqual(
+            StoredImage.objects.get(name='posts/other.gif').references, 1
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageCleanupQueueTests(TestCase):
+    """Файлы без ссылок удаляются из очереди, а не в запросе."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    def create_post(self, content=SMALL_GIF):
+        upload = SimpleUploadedFile(
+            name='image.gif', content=content, content_type='image/gif'
+        )
+        return Post.objects.create(text='Пост', author=self.user,
+                                   image=upload)
+
+    def test_deleted_post_image_queued(self):
+        post = self.create_post(SMALL_GIF + b'deleted')
+        name = post.image.name
+        storage = post.image.storage
+        post.delete()
+        # Удаление ждёт фиксации транзакции и фонового потока.
+        self.assertTrue(storage.exists(name))
+        self.assertTrue(ObsoleteImage.objects.filter(name=name).exists())
+
+        self.assertEqual(delete_obsolete_images(), 1)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(ObsoleteImage.objects.exists())
+
+    def test_cascade_and_reuploaded_image(self):
+        author = User.objects.create_user(username='cascade')
+        post = Post.objects.create(
+            text='Пост', author=author, image=SimpleUploadedFile(
+                'image.gif', SMALL_GIF + b'cascade', 'image/gif'
+            )
+        )
+        name = post.image.name
+        author.delete()
+        self.assertTrue(ObsoleteImage.objects.filter(name=name).exists())
+        # Пока файл ждал удаления, ту же картинку загрузили снова.
+        self.create_post(SMALL_GIF + b'cascade')
+
+        self.assertEqual(delete_obsolete_images(), 0)
+        self.assertTrue(post.image.storage.exists(name))
+        self.assertFalse(ObsoleteImage.objects.exists())
+
+    def test_background_runs_coalesce(self):
+        """Пока запуск не начался, повторные вызовы его не дублируют."""
+        started = threading.Event()
+        release = threading.Event()
+        executor = get_executor('coalesce-test')
+        executor.submit(lambda: started.set() or release.wait(5))
+        started.wait(5)
+        run = mock.Mock()
+        job = BackgroundJob('coalesce-test', run, 'Ошибка')
+        job.schedule()
+        job.schedule()
+        release.set()
+        executor.submit(lambda: None).result()
+        run.assert_called_once_with()
+        job.schedule()
+        executor.submit(lambda: None).result()
+        self.assertEqual(run.call_count, 2)
+
+
+class MaintainThumbnailsTests(TestCase):
+    """Команда maintain_thumbnails."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+        # Своя папка на каждый тест: миниатюры одинаковых картинок
+        # иначе переживали бы тест.
+        media_root = tempfile.mkdtemp(dir=TEMP_ROOT)
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.state = os.path.join(media_root, 'state.json')
+        self.post = Post.objects.create(
+            text='Пост', author=self.user, image=SimpleUploadedFile(
+                name='small.gif', content=SMALL_GIF, content_type='image/gif'
+            )
+        )
+
+    def maintain(self, *args):
+        output = io.StringIO()
+        call_command(
+            'maintain_thumbnails', *args, '--workers', '0',
+            '--min-age', '0', '--state', self.state, stdout=output,
+        )
+        return output.getvalue()
+
+    def test_render_creates_all_variants(self):
+        output = self.maintain('--render')
+        names = thumbnail_names(self.post.image.name)
+        for name in names:
+            self.assertTrue(default.storage.exists(name), name)
+        self.assertIn('render: 1/1', output)
+        self.assertFalse(os.path.exists(self.state))
+
+    def test_gc_removes_orphans_only(self):
+        self.maintain('--render')
+        orphan = 'cache/00/00/orphan.jpg'
+        default.storage.save(orphan, io.BytesIO(SMALL_GIF))
+        stale_key = add_prefix('stale', 'image')
+        default.kvstore._set_raw(
+            stale_key, '{"name": "posts/gone.gif", "storage": "x"}'
+        )
+
+        self.maintain('--gc')
+        self.assertFalse(default.storage.exists(orphan))
+        for name in thumbnail_names(self.post.image.name):
+            self.assertTrue(default.storage.exists(name), name)
+        self.assertIsNone(default.kvstore._get_raw(stale_key))
+
+    def test_resume_skips_finished_chunks(self):
+        with open(self.state, 'w') as state_file:
+            json.dump({
+                'params': {'gc': False, 'render': ['card'],
+                           'dry_run': False},
+                'done': {'render': [self.post.image.name]},
+            }, state_file)
+        output = self.maintain('--render', 'card')
+        self.assertIn('Продолжаем', output)
+        for name in thumbnail_names(self.post.image.name):
+            self.assertFalse(default.storage.exists(name), name)
+
+
+class ResizeEndpointTests(TestCase):
+    """Картинки по запросу /media/resize/<подписанные параметры>/."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    def setUp(self):
+        root = tempfile.mkdtemp(dir=TEMP_ROOT)
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        media = self.settings(
+            MEDIA_ROOT=os.path.join(root, 'media'),
+            RESIZE_CACHE_DIR=os.path.join(root, 'resize'),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.post = Post.objects.create(
+            text='Пост', author=self.user,
+            image=NormalizeImageTests.jpeg((40, 20)),
+        )
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            return response, None
+        data = b''.join(response.streaming_content)
+        return response, Image.open(io.BytesIO(data))
+
+    def test_resize_and_crop(self):
+        name = self.post.image.name
+        response, image = self.fetch(resize.resize_url(name, 10, 10))
+        self.assertEqual(image.size, (10, 5))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        _, image = self.fetch(
+            resize.resize_url(name, 10, 10, crop=True, image_format='WEBP')
+        )
+        self.assertEqual((image.size, image.format), ((10, 10), 'WEBP'))
+
+    def test_result_cached_on_disk(self):
+        url = resize.resize_url(self.post.image.name, 10, 10)
+        self.fetch(url)
+        with mock.patch.object(resize, '_render') as render:
+            response, image = self.fetch(url)
+        render.assert_not_called()
+        self.assertEqual(image.size, (10, 5))
+
+    def test_bad_signature_and_missing_file(self):
+        url = resize.resize_url(self.post.image.name, 10, 10)
+        self.assertEqual(self.client.get(url[:-2] + 'x/').status_code, 404)
+        for url in (resize.resize_url('posts/missing.jpg', 10, 10),
+                    resize.resize_url(self.post.image.name, 10, 10 ** 6)):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_concurrent_requests_render_once(self):
+        params = resize.load_params(
+            resize.resize_url(self.post.image.name, 10, 10).split('/')[-2]
+        )
+        render = resize._render
+
+        def slow_render(*args):
+            time.sleep(0.1)
+            return render(*args)
+
+        with mock.patch.object(resize, '_render',
+                               side_effect=slow_render) as mocked:
+            threads = [
+                threading.Thread(
+                    target=lambda: resize.open_resized(params).close()
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mocked.call_count, 1)
+
+    def test_evict_least_recently_used(self):
+        paths = []
+        for width in (10, 11, 12):
+            params = resize.load_params(resize.resize_url(
+                self.post.image.name, width, width
+            ).split('/')[-2])
+            resize.open_resized(params).close()
+            paths.append(resize.cache_path(params))
+        for age, path in zip((300, 100, 200), paths):
+            os.utime(path, (time.time() - age,) * 2)
+        size = os.path.getsize(paths[1])
+        # Места хватает на два файла: уходит давно не читанный первый.
+        deleted = resize.evict(max_size=size * 2 / resize.LOW_WATERMARK)
+        self.assertEqual(deleted, 1)
+        self.assertEqual([os.path.exists(path) for path in paths],
+                         [False, True, True])
+
+    def test_evict_runs_in_background(self):
+        params = resize.load_params(
+            resize.resize_url(self.post.image.name, 10, 10).split('/')[-2]
+        )
+        threads = []
+        with self.settings(RESIZE_CACHE_MAX_SIZE=1), mock.patch.object(
+            resize, '_evict',
+            side_effect=lambda *args: threads.append(
+                threading.current_thread()
+            )
+        ):
+            resize.open_resized(params).close()
+            # Исполнитель однопоточный: пустая задача ждёт вытеснение.
+            get_executor('resize-evict').submit(lambda: None).result()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.current_thread())
@@ -1,7 +1,14 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.text import Truncator
 
-from ..models import Group, Post
+from ..forms import PostForm
+from ..models import Comment, FeedItem, Follow, Group, Post, UserStats
 
 User = get_user_model()
 
@@ -28,3 +35,206 @@ class PostModelTest(TestCase):
 
         self.assertEqual(post, str(post))
         self.assertEqual(group, str(group))
+
+
+class UserStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def assertStats(self, user, **expected):
+        stats = UserStats.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(stats, field), value)
+
+    def test_stats_follow_writes(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertStats(self.author, posts_count=1, followers_count=1)
+        self.assertStats(self.reader, comments_count=1, following_count=1)
+
+        follow.delete()
+        post.delete()
+        self.assertStats(self.author, posts_count=0, followers_count=0)
+        self.assertStats(self.reader, comments_count=0, following_count=0)
+
+    def test_cascade_delete_queries(self):
+        """Удаление поста не тратит запросы на каждый его комментарий."""
+        counts = []
+        for comments in (2, 20):
+            post = Post.objects.create(author=self.author, text='Пост')
+            for i in range(comments):
+                Comment.objects.create(
+                    post=post, author=(self.author, self.reader)[i % 2],
+                    text='Ок'
+                )
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertStats(self.author, posts_count=0, comments_count=0)
+        self.assertStats(self.reader, comments_count=0)
+
+    def test_cascade_delete_of_commenter(self):
+        """Удаление пользователя пересчитывает чужие посты с его ответами."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        commenter = User.objects.create_user(username='commenter')
+        Comment.objects.create(post=post, author=commenter, text='Ушёл')
+        kept = Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Comment.objects.create(post=post, author=commenter, text='Ушёл')
+        commenter.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.last_comment_at, kept.created)
+        self.assertStats(self.reader, comments_count=1)
+
+    def test_recount_stats_command(self):
+        """Команда recount_stats восстанавливает счётчики."""
+        Post.objects.create(author=self.author, text='Пост')
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('recount_stats', stdout=StringIO())
+        self.assertStats(self.author, posts_count=1)
+        self.assertStats(self.reader, posts_count=0)
+
+
+class PostCommentCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def assertCounters(self, count, last_comment):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, count)
+        self.assertEqual(self.post.last_comment_at,
+                         last_comment and last_comment.created)
+
+    def test_counters_follow_comments(self):
+        """Счётчик и время последнего комментария меняются с записями."""
+        first = Comment.objects.create(
+            post=self.post, author=self.author, text='Первый'
+        )
+        second = Comment.objects.create(
+            post=self.post, author=self.author, text='Второй'
+        )
+        self.assertCounters(2, second)
+        second.delete()
+        self.assertCounters(1, first)
+        first.delete()
+        self.assertCounters(0, None)
+
+    def test_edit_keeps_concurrent_comment(self):
+        """Правка загруженного раньше поста не сбрасывает счётчик."""
+        post = Post.objects.get(pk=self.post.pk)
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        form = PostForm({'text': 'Исправленный пост'}, instance=post)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertCounters(1, comment)
+        self.assertEqual(self.post.text, 'Исправленный пост')
+
+    def test_copy_and_resave_deleted(self):
+        """Копия поста и удалённый пост сохраняются новыми записями."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.pk = None
+        post.save()
+        self.assertNotEqual(post.pk, self.post.pk)
+        self.assertEqual(Post.objects.get(pk=post.pk).text, 'Пост')
+        post.delete()
+        post.save()
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_recount_comments(self):
+        """recount_stats восстанавливает счётчики комментариев постов."""
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Ок'
+        )
+        Post.objects.update(comment_count=42, last_comment_at=None)
+        call_command('recount_stats', stdout=StringIO())
+        self.assertCounters(1, comment)
+
+    def test_most_discussed_uses_index(self):
+        """Сортировка по обсуждаемости идёт по индексу, без GROUP BY."""
+        plan = Post.objects.order_by('-comment_count', '-id')[:10].explain()
+        self.assertIn('post_comment_count_idx', plan)
+
+
+class PostExcerptTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    def test_excerpt_follows_text(self):
+        """Начало текста совпадает с truncatechars:100 и при правке."""
+        text = 'Длинный текст поста. ' * 20
+        post = Post.objects.create(author=self.author, text=text)
+        self.assertEqual(post.excerpt, Truncator(text).chars(100))
+        self.assertEqual(len(post.excerpt), 100)
+        post.text = 'Короткий'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'Короткий')
+
+    def test_feed_defers_text(self):
+        """Лента не читает полный текст постов."""
+        Post.objects.create(author=self.author, text='Пост')
+        post = Post.objects.for_feed().get()
+        self.assertIn('text', post.get_deferred_fields())
+        self.assertEqual(post.excerpt, 'Пост')
+
+
+class FeedItemTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def feed(self):
+        return list(
+            FeedItem.objects.filter(user=self.reader)
+            .values_list('post_id', flat=True)
+        )
+
+    def test_feed_follows_writes(self):
+        """Лента заполняется при публикации и чистится при удалении."""
+        old_post = Post.objects.create(author=self.author, text='Старый')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.feed(), [old_post.pk])
+
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertCountEqual(self.feed(), [old_post.pk, new_post.pk])
+
+        old_post.delete()
+        self.assertEqual(self.feed(), [new_post.pk])
+
+        follow.delete()
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_PUSH_MAX_FOLLOWERS=1)
+    def test_backfill_when_author_drops_below_threshold(self):
+        """Отписка, опустившая автора под порог, дозаполняет ленты."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        follow = Follow.objects.create(user=other, author=self.author)
+        posts = [
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+            for i in range(3)
+        ]
+        # Часть ленты уже есть: вставка не должна её дублировать.
+        FeedItem.backfill(self.reader.pk, self.author.pk)
+        FeedItem.objects.filter(post=posts[0]).delete()
+        follow.delete()
+        self.assertCountEqual(self.feed(), [post.pk for post in posts])
+        self.assertFalse(FeedItem.objects.filter(user=other).exists())
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+from PIL import Image
+
+from ..models import Post, Upload, User
+from .test_images import SMALL_GIF, TEMP_ROOT
+
+
+class ChunkedUploadTests(TestCase):
+    """Загрузка картинки частями и создание поста по токену."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+
+    def setUp(self):
+        root = tempfile.mkdtemp(dir=TEMP_ROOT)
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        paths = self.settings(
+            MEDIA_ROOT=os.path.join(root, 'media'),
+            UPLOAD_DIR=os.path.join(root, 'uploads'),
+            UPLOAD_CHUNK_SIZE=16,
+        )
+        paths.enable()
+        self.addCleanup(paths.disable)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def start(self, data=SMALL_GIF, checksum=None):
+        response = self.client.post(reverse('posts:upload_create'), {
+            'filename': 'small.gif',
+            'size': len(data),
+            'sha256': checksum or hashlib.sha256(data).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()['token']
+
+    def send(self, token, offset, chunk):
+        return self.client.post(
+            reverse('posts:upload_chunk', args=[token]) + f'?offset={offset}',
+            chunk, content_type='application/octet-stream',
+        )
+
+    def upload(self, data=SMALL_GIF):
+        token = self.start(data)
+        for offset in range(0, len(data), 16):
+            response = self.send(token, offset, data[offset:offset + 16])
+        self.assertTrue(response.json()['complete'])
+        return token
+
+    def test_resume_after_interrupted_chunk(self):
+        token = self.start()
+        self.send(token, 0, SMALL_GIF[:16])
+        # Обрыв: дошла только часть второй порции.
+        self.send(token, 16, SMALL_GIF[16:20])
+        state = self.client.get(
+            reverse('posts:upload_chunk', args=[token])
+        ).json()
+        self.assertEqual(state['offset'], 20)
+
+        response = self.send(token, 40, SMALL_GIF[40:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 20)
+
+        self.send(token, 16, SMALL_GIF[16:32])
+        response = self.send(token, 32, SMALL_GIF[32:])
+        self.assertTrue(response.json()['complete'])
+        with open(Upload.objects.get(token=token).path, 'rb') as file:
+            self.assertEqual(file.read(), SMALL_GIF)
+
+    def test_chunk_limits_and_checksum(self):
+        token = self.start()
+        self.assertEqual(self.send(token, 0, SMALL_GIF[:17]).status_code, 413)
+
+        token = self.start(checksum='0' * 64)
+        for offset in (0, 16):
+            self.send(token, offset, SMALL_GIF[offset:offset + 16])
+        response = self.send(token, 32, SMALL_GIF[32:])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertFalse(response.json()['complete'])
+
+    def test_post_created_from_upload(self):
+        token = self.upload()
+        response = self.client.post(reverse('posts:post_create'), {
+            'text': 'Пост', 'upload_token': token,
+        })
+        self.assertRedirects(
+            response, reverse('posts:profile', args=[self.user.username])
+        )
+        post = Post.objects.get(text='Пост')
+        self.assertRegex(post.image.name, r'^posts/[0-9a-f]{2}/')
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertFalse(Upload.objects.filter(token=token).exists())
+        self.assertFalse(os.listdir(settings.UPLOAD_DIR))
+
+    def test_foreign_or_incomplete_upload_rejected(self):
+        complete = self.upload()
+        incomplete = self.start()
+        other = Client()
+        other.force_login(self.other)
+        for client, token in ((other, complete), (self.client, incomplete)):
+            with self.subTest(token=token):
+                response = client.post(reverse('posts:post_create'), {
+                    'text': 'Пост', 'upload_token': token,
+                })
+                self.assertFormError(
+                    response, 'form', 'image',
+                    'Загрузка не найдена или не завершена.'
+                )
+        self.assertEqual(
+            other.get(
+                reverse('posts:upload_chunk', args=[complete])
+            ).status_code, 404
+        )
+
+    def test_decompression_bomb_rejected(self):
+        token = self.upload()
+        # Предел Pillow, выше которого Image.open() бросает
+        # DecompressionBombError, а не OSError.
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 0):
+            response = self.client.post(reverse('posts:post_create'), {
+                'text': 'Пост', 'upload_token': token,
+            })
+        self.assertFormError(
+            response, 'form', 'image',
+            'Загруженный файл не является картинкой.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_clear_expired_uploads(self):
+        token = self.upload()
+        path = Upload.objects.get(token=token).path
+        with self.settings(UPLOAD_EXPIRY=-1):
+            call_command('clear_uploads', stdout=io.StringIO())
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(path))
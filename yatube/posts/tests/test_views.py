@@ -1,16 +1,25 @@
+import io
 import os
 import shutil
 import tempfile
 
+from unittest import mock
+
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import Follow, Group, Post, User
+from ..cards import card_stats, reset_card_stats
+from ..forms import PostForm
+from ..models import Comment, FeedItem, Follow, Group, Post, User
+from ..paginators import CachedCountPaginator, encode_cursor
 
 User = get_user_model()
 
@@ -111,7 +120,10 @@ class PostsPagesTests(TestCase):
         )
         response = self.authorized_client.get(reverse('posts:index'))
         content_1 = response.content
-        post_cache.delete()
+        # Изменение в обход сигналов не сбрасывает кэш.
+        Post.objects.filter(pk=post_cache.pk).update(
+            text='Изменённый', excerpt='Изменённый'
+        )
         response = self.authorized_client.get(reverse('posts:index'))
         content_2 = response.content
         self.assertEqual(content_1, content_2)
@@ -121,6 +133,28 @@ class PostsPagesTests(TestCase):
         content_3 = response.content
         self.assertNotEqual(content_1, content_3)
 
+    def test_index_page_cache_follows_writes(self):
+        """Удаление поста сразу сбрасывает кэш главной страницы."""
+        post_cache = Post.objects.create(
+            author=self.user,
+            text='Кэш пост'
+        )
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, post_cache.text)
+        post_cache.delete()
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertNotContains(response, post_cache.text)
+
+    def test_index_page_cache_shared_between_users(self):
+        """Лента в кэше общая, шапка отрисовывается для каждого."""
+        self.client.get(reverse('posts:index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, self.user.username)
+        self.assertFalse(
+            any('posts_post' in query['sql'] for query in queries)
+        )
+
     def test_group_list_page_show_correct_context(self):
         """Шаблон group_list сформирован с правильным контекстом."""
         response = (self.authorized_client.get(
@@ -268,6 +302,7 @@ class PaginatorViewsTest(TestCase):
     def setUp(self):
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
+        cache.clear()
 
     def test_paginator_is_correct(self):
         """Тестируем корректность работы пагинатора."""
@@ -289,3 +324,643 @@ class PaginatorViewsTest(TestCase):
                 response = self.client.get(reverse_name)
                 response_number = len(response.context['page_obj'])
                 self.assertEqual(response_number, post_number)
+
+    def test_cursor_pages_cover_all_posts(self):
+        """Переход по курсорам «Следующая» проходит все посты по порядку."""
+        expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)
+        )
+        response = self.client.get(reverse('posts:index'))
+        page_obj = response.context['page_obj']
+        self.assertTrue(page_obj.cursor.keyset)
+        self.assertFalse(page_obj.cursor.has_previous)
+        seen = [post.id for post in page_obj]
+        response = self.client.get(
+            reverse('posts:index') + f'?after={page_obj.cursor.next}'
+        )
+        page_obj = response.context['page_obj']
+        seen += [post.id for post in page_obj]
+        self.assertEqual(seen, expected)
+        self.assertFalse(page_obj.cursor.has_next)
+
+        response = self.client.get(
+            reverse('posts:index') + f'?before={page_obj.cursor.previous}'
+        )
+        self.assertEqual(
+            [post.id for post in response.context['page_obj']],
+            expected[:settings.OBJECTS_PER_PAGE]
+        )
+
+    def test_cursor_page_without_count(self):
+        """Страница по курсору не выполняет COUNT(*)."""
+        group_url = reverse(
+            'posts:group_lists', kwargs={'slug': self.group.slug}
+        )
+        first_page = self.client.get(group_url).context['page_obj']
+        url = group_url + f'?after={first_page.cursor.next}'
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+    def test_page_count_is_cached(self):
+        """COUNT(*) выполняется один раз и сбрасывается новым постом."""
+        url = reverse(
+            'posts:group_lists', kwargs={'slug': self.group.slug}
+        ) + '?page=2'
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+        Post.objects.create(text='Новый', author=self.user, group=self.group)
+        response = self.client.get(url)
+        self.assertEqual(
+            response.context['page_obj'].paginator.count,
+            self.posts_amount + 1
+        )
+
+    def test_elided_page_range(self):
+        """Номера страниц выводятся окном вокруг текущей."""
+        paginator = CachedCountPaginator(Post.objects.all(), 1)
+        ellipsis = paginator.ELLIPSIS
+        cases = {
+            1: [1, 2, 3, ellipsis, 13],
+            7: [1, ellipsis, 5, 6, 7, 8, 9, ellipsis, 13],
+            13: [1, ellipsis, 11, 12, 13],
+        }
+        for number, expected in cases.items():
+            with self.subTest(number=number):
+                self.assertEqual(
+                    paginator.get_page(number).elided_page_range, expected
+                )
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        """Испорченный курсор открывает первую страницу."""
+        response = self.client.get(reverse('posts:index') + '?after=broken')
+        self.assertEqual(
+            len(response.context['page_obj']), settings.OBJECTS_PER_PAGE
+        )
+        self.assertFalse(response.context['page_obj'].cursor.has_previous)
+
+    def test_out_of_range_cursor_falls_back_to_first_page(self):
+        """Курсор с id вне целого SQLite открывает первую страницу."""
+        post = Post.objects.latest('pub_date', 'id')
+        post.pk = 2 ** 70
+        response = self.client.get(
+            reverse('posts:index'), {'after': encode_cursor(post)}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].cursor.has_previous)
+
+
+class FeedFixturesMixin:
+    """Посты трёх авторов в трёх группах и читатель, подписанный на всех."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        cls.groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'group-{i}', description='-'
+            )
+            for i in range(3)
+        ]
+        Post.objects.bulk_create(
+            Post(
+                text=f'Пост {i}',
+                author=cls.authors[i % 3],
+                group=cls.groups[i % 3] if i % 4 else None,
+            )
+            for i in range(settings.OBJECTS_PER_PAGE + 5)
+        )
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+
+class FeedQueryBudgetTests(FeedFixturesMixin, TestCase):
+    """Число запросов ленты не зависит от числа постов на странице."""
+    # (страница по курсору, страница ?page=N с COUNT(*)); группа
+    # и профиль тратят ещё один запрос на поиск id для ETag.
+    QUERY_BUDGETS = {
+        'posts:index': (3, 4),
+        'posts:group_lists': (5, 6),
+        'posts:profile': (6, 7),
+        'posts:follow_index': (5, 4),
+    }
+
+    def test_feed_query_budgets(self):
+        """Страницы ленты укладываются в бюджет запросов."""
+        urls = {
+            'posts:index': {},
+            'posts:group_lists': {'slug': self.groups[1].slug},
+            'posts:profile': {'username': self.authors[0].username},
+            'posts:follow_index': {},
+        }
+        for name, kwargs in urls.items():
+            budgets = zip(('', '?page=2'), self.QUERY_BUDGETS[name])
+            for query, budget in budgets:
+                url = reverse(name, kwargs=kwargs) + query
+                with self.subTest(url=url):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.reader_client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertLessEqual(
+                        len(queries), budget,
+                        '\n'.join(query['sql'] for query in queries)
+                    )
+
+
+@override_settings(FEED_PUSH_MAX_FOLLOWERS=1, FEED_RECENT_POSTS=5)
+class HybridFollowFeedTests(TestCase):
+    """Лента подписок сливает push-строки и посты популярных авторов."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.other_reader = User.objects.create_user(username='other')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='author')
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=cls.other_reader, author=cls.star)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(15):
+            Post.objects.create(
+                author=cls.star if i % 2 else cls.author, text=f'Пост {i}'
+            )
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def test_star_posts_are_not_fanned_out(self):
+        """Посты автора выше порога не пишутся в FeedItem."""
+        self.assertFalse(
+            FeedItem.objects.filter(author=self.star).exists()
+        )
+        self.assertEqual(
+            FeedItem.objects.filter(user=self.reader).count(), 8
+        )
+
+    def test_hybrid_feed_pages(self):
+        """Курсорные страницы ленты совпадают с запросом по подпискам."""
+        expected = list(
+            Post.objects.filter(author__following__user=self.reader)
+            .order_by('-pub_date', '-id').values_list('id', flat=True)
+        )
+        url = reverse('posts:follow_index')
+        seen = []
+        query = ''
+        while True:
+            page_obj = self.reader_client.get(url + query).context[
+                'page_obj']
+            seen += [post.id for post in page_obj]
+            if not page_obj.cursor.has_next:
+                break
+            query = f'?after={page_obj.cursor.next}'
+        self.assertEqual(seen, expected)
+
+        page_obj = self.reader_client.get(
+            url + f'?before={page_obj.cursor.previous}'
+        ).context['page_obj']
+        self.assertEqual(
+            [post.id for post in page_obj],
+            expected[:settings.OBJECTS_PER_PAGE]
+        )
+
+    def test_naive_cursor_opens_first_page(self):
+        """Курсор с датой без часового пояса не роняет слияние ленты."""
+        post = Post.objects.filter(author=self.star).latest('pub_date')
+        post.pub_date = post.pub_date.replace(tzinfo=None)
+        url = reverse('posts:follow_index')
+        for direction in ('after', 'before'):
+            with self.subTest(direction=direction):
+                response = self.reader_client.get(
+                    url, {direction: encode_cursor(post)}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(
+                    response.context['page_obj'].cursor.has_previous
+                )
+
+
+class QueryPlanTests(FeedFixturesMixin, TestCase):
+    """Запросы страниц используют индексы, а не полный просмотр таблиц."""
+
+    def assertUsesIndexes(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        for step in plan:
+            self.assertNotRegex(step, r'^SCAN (TABLE )?\w+$', (sql, plan))
+            self.assertNotIn('USE TEMP B-TREE', step, (sql, plan))
+
+    def test_views_do_not_scan_tables(self):
+        """EXPLAIN QUERY PLAN основных запросов страниц без SCAN таблиц."""
+        post = Post.objects.first()
+        group_url = reverse(
+            'posts:group_lists', kwargs={'slug': self.groups[1].slug}
+        )
+        profile_url = reverse(
+            'posts:profile', kwargs={'username': self.authors[0].username}
+        )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:index') + '?page=2',
+            group_url,
+            group_url + '?page=2',
+            profile_url,
+            profile_url + '?page=2',
+            # ?page=N ленты подписок идёт через JOIN с Follow и
+            # сортирует выборку: это режим совместимости, не проверяем.
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': post.id}),
+        )
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.reader_client.get(url)
+            for query in queries:
+                with self.subTest(url=url, sql=query['sql']):
+                    self.assertUsesIndexes(query['sql'])
+
+
+class ConditionalGetTests(TestCase):
+    """Повторный запрос страницы с ETag отвечает 304 без запроса ленты."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-'
+        )
+        cls.post = Post.objects.create(
+            text='Пост', author=cls.user, group=cls.group
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        cache.clear()
+        self.urls = {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_lists', args=[self.group.slug]),
+            'profile': reverse('posts:profile', args=[self.user.username]),
+            'post': reverse('posts:post_detail', args=[self.post.pk]),
+        }
+
+    def revalidate(self, url):
+        # Первый ответ выставляет CSRF-cookie, которая входит в ETag.
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, [query['sql'] for query in queries]
+
+    def test_not_modified(self):
+        """Неизменённая страница отдаётся как 304 без чтения постов."""
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response, queries = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(
+                    [sql for sql in queries if 'posts_comment' in sql
+                     or 'FROM "posts_post" INNER JOIN' in sql],
+                    '\n'.join(queries),
+                )
+
+    def test_last_modified(self):
+        """Анониму отдаётся Last-Modified и учитывается If-Modified-Since."""
+        guest = Client()
+        response = guest.get(self.urls['group'])
+        response = guest.get(
+            self.urls['group'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_last_modified_for_users(self):
+        """Страницу пользователя нельзя подтвердить одной датой."""
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.client.get(url)
+                self.assertNotIn('Last-Modified', response)
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=Client().get(url)[
+                        'Last-Modified']
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_changes_invalidate_etag(self):
+        """Новый пост и комментарий меняют ETag затронутых страниц."""
+        etags = {name: self.client.get(url)['ETag']
+                 for name, url in self.urls.items()}
+        Post.objects.create(text='Новый', author=self.user, group=self.group)
+        for name in ('index', 'group', 'profile'):
+            with self.subTest(page=name):
+                response = self.client.get(
+                    self.urls[name], HTTP_IF_NONE_MATCH=etags[name]
+                )
+                self.assertEqual(response.status_code, 200)
+        etag = self.client.get(self.urls['post'])['ETag']
+        self.post.comments.create(author=self.user, text='Комментарий')
+        response = self.client.get(
+            self.urls['post'], HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """Другой пользователь не получает чужую закэшированную шапку."""
+        etag = self.client.get(self.urls['index'])['ETag']
+        response = Client().get(self.urls['index'], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_object(self):
+        """Для несуществующих объектов по-прежнему отдаётся 404."""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk + 100])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(COMMENTS_PER_PAGE=3)
+class CommentsPaginationTests(TestCase):
+    """Комментарии выводятся порциями по курсору, с автором в JOIN."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        commenters = [
+            User.objects.create_user(username=f'reader_{i}')
+            for i in range(7)
+        ]
+        for i, commenter in enumerate(commenters):
+            Comment.objects.create(
+                post=cls.post, author=commenter, text=f'Комментарий {i}'
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_comments_loaded_in_batches(self):
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk])
+        )
+        texts = [comment.text for comment in response.context['comments']]
+        self.assertEqual(texts, [f'Комментарий {i}' for i in range(3)])
+        loaded = texts
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        after = response.context['comments_next']
+        while after:
+            self.assertContains(response, f'{url}?after={after}')
+            response = self.client.get(url, {'after': str(after)})
+            loaded += [
+                comment.text for comment in response.context['comments']
+            ]
+            after = response.context['comments_next']
+        self.assertEqual(loaded, [f'Комментарий {i}' for i in range(7)])
+        self.assertNotContains(response, 'Показать ещё')
+
+    def test_batch_query_count_constant(self):
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        # Проверка поста и одна выборка комментариев вместе с авторами.
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_count_on_cards(self):
+        url = reverse('posts:profile', args=[self.author.username])
+        self.assertContains(self.client.get(url), 'Комментариев: 7')
+        Comment.objects.create(post=self.post, author=self.author, text='8')
+        self.assertContains(self.client.get(url), 'Комментариев: 8')
+
+    def test_missing_post(self):
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.pk + 100])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_out_of_range_cursor(self):
+        comment = Comment.objects.first()
+        comment.pk = 2 ** 70
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.pk]),
+            {'after': encode_cursor(comment, 'created')}
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class PostDetailCacheTests(TestCase):
+    """Фрагменты страницы поста кэшируются по его версии."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Комментарий'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:post_detail', args=[self.post.pk])
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def count_queries(self, client):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(self.url)
+        return response, len(queries)
+
+    def test_cached_render_skips_queries(self):
+        _, cold = self.count_queries(self.reader_client)
+        response, warm = self.count_queries(self.reader_client)
+        self.assertLess(warm, cold)
+        self.assertContains(response, 'Комментарий')
+        self.assertContains(response, 'Всего постов автора:  1')
+
+    def test_commenter_rename_refreshes_comments(self):
+        """Новое имя комментатора видно в кэшированном списке и фрагменте."""
+        comments_url = reverse('posts:post_comments', args=[self.post.pk])
+        # Первый ответ заполняет кэш и выставляет CSRF-cookie.
+        self.author_client.get(self.url)
+        etag = self.author_client.get(comments_url)['ETag']
+        self.reader.username = 'renamed'
+        self.reader.save()
+        response = self.author_client.get(self.url)
+        self.assertContains(response, 'renamed')
+        self.assertContains(
+            response, reverse('posts:profile', args=['renamed'])
+        )
+        response = self.author_client.get(
+            comments_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'renamed')
+
+    def test_edit_button_rendered_per_user(self):
+        self.reader_client.get(self.url)
+        response = self.author_client.get(self.url)
+        self.assertContains(response, 'Редактировать')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        response = self.reader_client.get(self.url)
+        self.assertNotContains(response, 'Редактировать')
+
+    def test_edit_and_comment_bump_version(self):
+        self.reader_client.get(self.url)
+        self.author_client.post(
+            reverse('posts:post_edit', args=[self.post.pk]),
+            {'text': 'Новый текст'},
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        self.assertContains(self.reader_client.get(self.url), 'Новый текст')
+
+        self.reader_client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Ещё комментарий'},
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 3)
+        self.assertContains(
+            self.reader_client.get(self.url), 'Ещё комментарий'
+        )
+
+    def test_stale_edit_bumps_version(self):
+        """Правка копии поста, загруженной до комментария, видна сразу."""
+        post = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Второй'
+        )
+        self.reader_client.get(self.url)
+        form = PostForm({'text': 'Исправленный текст'}, instance=post)
+        self.assertTrue(form.is_valid())
+        form.save()
+        post.refresh_from_db()
+        self.assertEqual(post.version, 3)
+        self.assertContains(
+            self.reader_client.get(self.url), 'Исправленный текст'
+        )
+
+    def test_group_changes_refresh_page(self):
+        group = Group.objects.create(
+            title='Группа', slug='group', description='-'
+        )
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        cache.clear()
+        self.assertContains(self.reader_client.get(self.url), 'Группа')
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(
+            self.reader_client.get(self.url), 'Новое название'
+        )
+        group.delete()
+        response = self.reader_client.get(self.url)
+        self.assertNotContains(response, 'Новое название')
+        self.assertNotContains(response, '/group/group/')
+
+    def test_author_posts_count_refreshed(self):
+        self.reader_client.get(self.url)
+        Post.objects.create(text='Второй', author=self.author)
+        self.assertContains(
+            self.reader_client.get(self.url), 'Всего постов автора:  2'
+        )
+
+
+class PostCardCacheTests(TestCase):
+    """Карточки постов лент кэшируются по (id, version) поста."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-'
+        )
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=cls.author, group=cls.group
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        reset_card_stats()
+        self.urls = [
+            reverse('posts:group_lists', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        ]
+
+    def test_cards_read_in_one_get_many(self):
+        for url in self.urls:
+            self.client.get(url)
+        with mock.patch.object(
+            cache, 'get_many', wraps=cache.get_many
+        ) as get_many:
+            responses = [self.client.get(url) for url in self.urls]
+        card_calls = [call for call in get_many.call_args_list
+                      if any(key.startswith('card:') for key in call[0][0])]
+        self.assertEqual(len(card_calls), len(self.urls))
+        for response in responses:
+            self.assertContains(response, 'Пост 2')
+        self.assertEqual(
+            card_stats(), {'hits': 6, 'misses': 6, 'hit_rate': 0.5}
+        )
+
+    def test_feeds_share_cards(self):
+        self.client.get(self.urls[0])
+        self.client.get(reverse('posts:index'))
+        self.assertEqual(card_stats()['hits'], 3)
+
+    def test_new_version_rerenders_card(self):
+        url = self.urls[0]
+        self.client.get(url)
+        post = self.posts[0]
+        post.text = 'Исправленный пост'
+        post.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Исправленный пост')
+        self.assertEqual(card_stats()['misses'], 4)
+
+    def test_author_rename_rerenders_cards(self):
+        for url in (self.urls[0], reverse('posts:index')):
+            self.client.get(url)
+        self.author.first_name = 'Лев'
+        self.author.last_name = 'Толстой'
+        self.author.save()
+        for url in (self.urls[0], reverse('posts:index')):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Лев Толстой')
+        # Вход пользователя меняет только last_login: версии постов те же.
+        versions = list(Post.objects.values_list('version', flat=True))
+        self.client.force_login(self.author)
+        self.assertEqual(
+            list(Post.objects.values_list('version', flat=True)), versions
+        )
+
+    def test_stats_command(self):
+        self.client.get(self.urls[0])
+        self.client.get(self.urls[0])
+        out = io.StringIO()
+        call_command('card_cache_stats', '--reset', stdout=out)
+        self.assertIn('доля попаданий: 50.0%', out.getvalue())
+        self.assertEqual(card_stats()['hits'], 0)
@@ -0,0 +1,253 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .background import get_executor
+from .caching import (FEED, author_scope, bump_versions, group_scope,
+                      post_scope)
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+WEBP = 'WEBP'
+
+
+class ResponsiveImage:
+    """Картинка поста для <picture>: src по умолчанию и наборы srcset.
+
+    width и height - размеры основной геометрии, чтобы браузер
+    резервировал место под картинку до её загрузки, placeholder -
+    микроминиатюра, которая видна, пока картинка грузится.
+    """
+
+    def __init__(self, url, width, height, srcset='', webp_srcset='',
+                 placeholder=''):
+        self.url = url
+        self.width = width
+        self.height = height
+        self.srcset = srcset
+        self.webp_srcset = webp_srcset
+        self.placeholder = placeholder
+        self.sizes = settings.POST_THUMBNAIL_SIZES
+
+
+def geometry_size(geometry):
+    width, height = geometry.split('x')
+    return int(width), int(height)
+
+
+def thumbnail_variants(alias):
+    """Варианты миниатюры alias: (ширина, формат, геометрия, опции).
+
+    Для каждой ширины POST_THUMBNAIL_WIDTHS с пропорциями основной
+    геометрии создаются WebP и запасной вариант в формате оригинала
+    (format=None).
+    """
+    geometry, options = settings.POST_THUMBNAILS[alias]
+    width, height = geometry_size(geometry)
+    for variant_width in settings.POST_THUMBNAIL_WIDTHS:
+        variant_height = round(height * variant_width / width)
+        for image_format in (WEBP, None):
+            yield (
+                variant_width, image_format,
+                f'{variant_width}x{variant_height}',
+                {**options, 'format': image_format},
+            )
+
+
+def thumbnail_options(source, options):
+    """Полные опции миниатюры, как их дополняет get_thumbnail() sorl."""
+    options = dict(options)
+    backend = default.backend
+    if options.get('format', '') is None:
+        options['format'] = backend._get_format(source)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(name, geometry, options):
+    """Файл миниатюры картинки name, без генерации."""
+    source = ImageFile(name)
+    thumbnail_name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, options)
+    )
+    return ImageFile(thumbnail_name, default.storage)
+
+
+def _get_raw_many(keys):
+    """Значения хранилища sorl по ключам: один get_many и один запрос."""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        values = {key: kvstore._get_raw(key) for key in keys}
+        return {key: value for key, value in values.items() if value}
+    cached = kvstore.cache.get_many(keys)
+    values = {key: value for key, value in cached.items()
+              if value is not cached_db_kvstore.EMPTY_VALUE}
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        rows = dict(
+            KVStoreModel.objects.filter(key__in=missing)
+            .values_list('key', 'value')
+        )
+        values.update(rows)
+        # Промахи тоже кэшируются, как это делает сам KVStore sorl.
+        kvstore.cache.set_many(
+            {key: rows.get(key, cached_db_kvstore.EMPTY_VALUE)
+             for key in missing},
+            sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+    return values
+
+
+def _srcset(images):
+    return ', '.join(
+        f'{image.url} {width}w' for width, image in sorted(images.items())
+    )
+
+
+def _responsive_image(post, alias, ready):
+    """Собирает ResponsiveImage из готовых вариантов {(ширина, формат)}."""
+    width, height = geometry_size(settings.POST_THUMBNAILS[alias][0])
+    fallback = {w: file for (w, fmt), file in ready.items() if fmt is None}
+    webp = {w: file for (w, fmt), file in ready.items() if fmt == WEBP}
+    if not fallback:
+        # Пока миниатюр нет, показывается оригинал в своих пропорциях.
+        if post.image_width and post.image_height:
+            width, height = post.image_width, post.image_height
+        return ResponsiveImage(post.image.url, width, height,
+                               placeholder=post.image_placeholder)
+    default_width = width if width in fallback else max(fallback)
+    return ResponsiveImage(
+        fallback[default_width].url, width, height,
+        srcset=_srcset(fallback), webp_srcset=_srcset(webp),
+        placeholder=post.image_placeholder,
+    )
+
+
+def prefetch_thumbnails(posts):
+    """Раскладывает по постам страницы готовые миниатюры всех геометрий.
+
+    Все варианты миниатюр всех постов читаются из хранилища sorl одним
+    get_many вместо обращения на каждый тег. В post.thumbnails попадает
+    словарь alias -> ResponsiveImage. Пока варианты не созданы, в нём
+    лежит оригинал, а генерация ставится в очередь - страница никогда
+    не ресайзит картинку сама.
+    """
+    wanted = {}
+    for post in posts:
+        post.thumbnails = {}
+        if not post.image:
+            continue
+        for alias in settings.POST_THUMBNAILS:
+            for variant in thumbnail_variants(alias):
+                width, image_format, geometry, options = variant
+                thumbnail = thumbnail_file(post.image.name, geometry, options)
+                # Одинаковые картинки разных постов делят миниатюры.
+                wanted.setdefault(add_prefix(thumbnail.key), []).append(
+                    (post, alias, (width, image_format))
+                )
+    found = _get_raw_many(list(wanted))
+    ready = {}
+    for key, usages in wanted.items():
+        for post, alias, variant in usages:
+            variants = ready.setdefault((post, alias), {})
+            if key in found:
+                variants[variant] = deserialize_image_file(found[key])
+            else:
+                schedule_thumbnails(post.image.name)
+    for (post, alias), variants in ready.items():
+        post.thumbnails[alias] = _responsive_image(post, alias, variants)
+    return posts
+
+
+def thumbnail_names(name, aliases=None):
+    """Имена файлов всех вариантов миниатюр картинки name."""
+    return [
+        thumbnail_file(name, geometry, options).name
+        for alias in aliases or settings.POST_THUMBNAILS
+        for _, _, geometry, options in thumbnail_variants(alias)
+    ]
+
+
+def generate_thumbnails(name, aliases=None):
+    """Создаёт варианты миниатюр картинки (по умолчанию всех геометрий)."""
+    source = ImageFile(name)
+    for alias in aliases or settings.POST_THUMBNAILS:
+        for _, _, geometry, options in thumbnail_variants(alias):
+            get_thumbnail(
+                name, geometry, **thumbnail_options(source, options)
+            )
+
+
+def thumbnails_ready(name):
+    """Поднимает версии постов с картинкой name после создания миниатюр.
+
+    До этого их страницы и карточки в кэше показывали оригинал.
+    """
+    posts = Post.objects.filter(image=name)
+    rows = list(posts.values_list('id', 'author_id', 'group_id'))
+    if not rows:
+        return
+    posts.update(version=F('version') + 1)
+    scopes = {FEED}
+    for post_id, author_id, group_id in rows:
+        scopes.update((post_scope(post_id), author_scope(author_id)))
+        if group_id:
+            scopes.add(group_scope(group_id))
+    bump_versions(*scopes)
+
+
+def _run(name):
+    close_old_connections()
+    try:
+        generate_thumbnails(name)
+        thumbnails_ready(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры %s', name)
+    finally:
+        with _pending_lock:
+            _pending.discard(name)
+        close_old_connections()
+
+
+def _submit(name):
+    with _pending_lock:
+        if (name in _pending
+                or len(_pending) >= settings.POST_THUMBNAIL_QUEUE_SIZE):
+            # Картинка уже в очереди или очередь полна: шаблон покажет
+            # оригинал и поставит задачу при следующем показе.
+            return
+        _pending.add(name)
+    if not settings.POST_THUMBNAIL_WORKERS:
+        _run(name)
+        return
+    get_executor(
+        'thumbnails', settings.POST_THUMBNAIL_WORKERS
+    ).submit(_run, name)
+
+
+def schedule_thumbnails(name):
+    """Ставит генерацию миниатюр в пул после фиксации транзакции."""
+    if name:
+        transaction.on_commit(lambda: _submit(name))
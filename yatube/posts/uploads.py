@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+
+from .models import Upload
+
+logger = logging.getLogger(__name__)
+
+# Имя поля формы поста с токеном завершённой загрузки.
+UPLOAD_TOKEN = 'upload_token'
+
+READ_SIZE = 64 * 1024
+
+CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """Ошибка загрузки части с HTTP-статусом для ответа API."""
+
+    def __init__(self, message, upload=None, status=400):
+        super().__init__(message)
+        self.upload = upload
+        self.status = status
+
+
+def upload_state(upload):
+    return {
+        'token': str(upload.token),
+        'offset': upload.received,
+        'size': upload.size,
+        'complete': upload.complete,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+    }
+
+
+def start_upload(user, filename, size, checksum):
+    """Начинает загрузку файла size байт с SHA-256 checksum."""
+    filename = os.path.basename(filename or '')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('Укажите размер файла.')
+    checksum = (checksum or '').lower()
+    if not filename or len(filename) > 100:
+        raise UploadError('Укажите имя файла.')
+    if not 0 < size <= settings.POST_IMAGE_MAX_BYTES:
+        raise UploadError(
+            f'Файл больше {settings.POST_IMAGE_MAX_BYTES // (1024 * 1024)} '
+            f'МБ.', status=413
+        )
+    if not CHECKSUM_RE.match(checksum):
+        raise UploadError('Укажите SHA-256 файла.')
+    return Upload.objects.create(
+        user=user, filename=filename, size=size, checksum=checksum
+    )
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_chunk(upload, offset, stream):
+    """Пишет часть с позиции offset, читая stream потоком.
+
+    Часть можно прислать повторно с любой уже полученной позиции, если
+    соединение оборвалось. После последней части проверяется SHA-256:
+    при несовпадении загрузка начинается заново.
+    """
+    with transaction.atomic():
+        upload = Upload.objects.select_for_update().get(pk=upload.pk)
+        if upload.complete:
+            raise UploadError('Загрузка уже завершена.', upload, 409)
+        if not 0 <= offset <= upload.received:
+            raise UploadError(
+                f'Ожидается часть с позиции {upload.received}.', upload, 409
+            )
+        limit = min(offset + settings.UPLOAD_CHUNK_SIZE, upload.size)
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        mode = 'r+b' if os.path.exists(upload.path) else 'wb'
+        with open(upload.path, mode) as file:
+            file.seek(offset)
+            file.truncate()
+            position = offset
+            for chunk in iter(lambda: stream.read(READ_SIZE), b''):
+                position += len(chunk)
+                if position > limit:
+                    raise UploadError(
+                        'Часть больше допустимой.', upload, 413
+                    )
+                file.write(chunk)
+        upload.received = position
+        mismatch = (position == upload.size
+                    and _checksum(upload.path) != upload.checksum)
+        if mismatch:
+            upload.received = 0
+        else:
+            upload.complete = position == upload.size
+        upload.save(update_fields=('received', 'complete'))
+    if mismatch:
+        raise UploadError(
+            'Контрольная сумма не совпадает, загрузите файл заново.', upload
+        )
+    return upload
+
+
+def open_upload(user, token):
+    """Завершённая загрузка пользователя для PostForm: (Upload, File)."""
+    try:
+        upload = Upload.objects.get(token=token, user=user, complete=True)
+    except (Upload.DoesNotExist, ValidationError):
+        raise ValidationError(
+            'Загрузка не найдена или не завершена.', code='invalid_upload'
+        )
+    try:
+        file = open(upload.path, 'rb')
+    except FileNotFoundError:
+        raise ValidationError(
+            'Файл загрузки удалён, загрузите его заново.',
+            code='invalid_upload',
+        )
+    return upload, File(file, name=upload.filename)
+
+
+def delete_upload_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.warning('Не удалось удалить загрузку %s', path, exc_info=True)
@@ -11,6 +11,11 @@ urlpatterns = [
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<post_id>/edit/', views.post_edit, name='post_edit'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path(
         'posts/<int:post_id>/comment/',
         views.add_comment,
@@ -27,4 +32,15 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path(
+        'uploads/<uuid:token>/',
+        views.upload_chunk,
+        name='upload_chunk'
+    ),
+    path(
+        'media/resize/<str:params>/',
+        views.resize_image,
+        name='resize_image'
+    ),
 ]
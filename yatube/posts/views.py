@@ -1,32 +1,75 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_http_methods, require_POST
+from PIL import Image
 
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, Upload, User
+from .caching import (FEED, author_scope, follower_scope, get_version,
+                      group_scope)
+from .cards import CARD_TEMPLATE, attach_cards
+from .conditional import (comments_scopes, content_condition, group_scopes,
+                          index_scopes, post_scopes, profile_scopes)
+from .feeds import FollowFeed
+from .paginators import (CachedCountPaginator, FollowFeedPaginator,
+                         comments_page)
+from .resize import load_params, open_resized
+from .thumbnails import schedule_thumbnails
+from .uploads import UploadError, start_upload, upload_state, write_chunk
 
+RESIZE_MAX_AGE = 60 * 60 * 24 * 365
 
-def paginator_view(posts, request):
-    paginator = Paginator(posts, settings.OBJECTS_PER_PAGE)
+# В профиле автор известен, карточка без него.
+PROFILE_CARD_TEMPLATE = 'posts/includes/profile_post.html'
+
+
+def paginator_view(posts, request, paginator_class=CachedCountPaginator,
+                   card_template=CARD_TEMPLATE, **kwargs):
+    """Страница ленты: по курсору ?after=/?before= или по номеру ?page=N.
+
+    У постов страницы в post.card лежит готовый HTML карточки.
+    """
+    paginator = paginator_class(posts, settings.OBJECTS_PER_PAGE, **kwargs)
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if page_number is not None:
+        page_obj = paginator.get_page(page_number)
+    else:
+        page_obj = paginator.get_cursor_page(
+            request.GET.get('after'), request.GET.get('before')
+        )
+    attach_cards(page_obj, card_template)
     return page_obj
 
 
+@content_condition(index_scopes)
 def index(request):
-    post_list = Post.objects.all().order_by('-pub_date')
-    page_obj = paginator_view(post_list, request)
+    post_list = Post.objects.for_feed()
+    # Страница вычисляется лениво: при попадании в кэш фрагмента
+    # запрос ленты не выполняется.
+    page_obj = SimpleLazyObject(
+        lambda: paginator_view(post_list, request, count_scope=FEED)
+    )
     context = {
         'page_obj': page_obj,
+        'feed_version': get_version(FEED),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/index.html', context)
 
 
+@content_condition(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.order_by('-pub_date')
-    page_obj = paginator_view(posts, request)
+    posts = group.posts.for_feed()
+    page_obj = paginator_view(
+        posts, request, count_scope=group_scope(group.id)
+    )
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -34,10 +77,16 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@content_condition(profile_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts_list = author.posts.all()
-    page_obj = paginator_view(posts_list, request)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts_list = author.posts.for_feed()
+    page_obj = paginator_view(
+        posts_list, request, card_template=PROFILE_CARD_TEMPLATE,
+        count_scope=author_scope(author.id)
+    )
 
     if author.following.filter(author=author).all():
         following = True
@@ -51,26 +100,51 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@content_condition(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        id=post_id
+    )
     form = CommentForm()
-    comments = post.comments.all()
+    # Комментарии читаются лениво: при попадании в кэш фрагментов
+    # по версии поста запрос не выполняется.
+    batch = SimpleLazyObject(lambda: comments_page(post.comments.all()))
     context = {
         'post': post,
         'form': form,
-        'comments': comments
+        'comments': SimpleLazyObject(lambda: batch[0]),
+        'comments_next': SimpleLazyObject(lambda: batch[1]),
+        'post_cache_timeout': settings.POST_CACHE_TIMEOUT,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@content_condition(comments_scopes)
+def post_comments(request, post_id):
+    """Фрагмент со следующей порцией комментариев после ?after=."""
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404('Пост не найден')
+    comments, comments_next = comments_page(
+        Comment.objects.filter(post_id=post_id), request.GET.get('after')
+    )
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'comments_next': comments_next,
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     template = 'posts/post_create.html'
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(request.POST or None, files=request.FILES or None,
+                    user=request.user)
     if form.is_valid():
-        post = form.save(commit=False)
-        post.author = request.user
-        post.save()
+        form.instance.author = request.user
+        post = form.save()
+        schedule_thumbnails(post.image.name)
         return redirect('posts:profile', request.user.username)
     return render(request, template, {'form': form})
 
@@ -82,11 +156,16 @@ def post_edit(request, post_id):
     template = 'posts/post_create.html'
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
+    # Форма при проверке записывает новую картинку в сам пост.
+    image_name = post.image.name
     form = PostForm(
-        request.POST or None, files=request.FILES or None, instance=post
+        request.POST or None, files=request.FILES or None, instance=post,
+        user=request.user
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if post.image.name != image_name:
+            schedule_thumbnails(post.image.name)
         return redirect('posts:post_detail', post_id=post_id)
     context = {'form': form, 'is_edit': True}
     return render(request, template, context)
@@ -106,8 +185,14 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator_view(post_list, request)
+    post_list = Post.objects.for_feed().filter(
+        author__following__user=request.user
+    )
+    page_obj = paginator_view(
+        post_list, request, FollowFeedPaginator,
+        feed=FollowFeed(request.user),
+        count_scope=follower_scope(request.user.id),
+    )
     context = {
         'page_obj': page_obj,
     }
@@ -131,3 +216,56 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=user, author=author).delete()
     return render(request, 'posts/follow.html')
+
+
+def resize_image(request, params):
+    """Картинка поста нужного размера по подписанным параметрам."""
+    try:
+        params = load_params(params)
+        file = open_resized(params)
+    except (signing.BadSignature, ValueError, FileNotFoundError,
+            SuspiciousFileOperation, Image.UnidentifiedImageError):
+        raise Http404('Картинка не найдена')
+    response = FileResponse(file, content_type=Image.MIME[params['f']])
+    # Имя оригинала задаёт его содержимое, поэтому адрес не устаревает.
+    patch_cache_control(response, public=True, max_age=RESIZE_MAX_AGE,
+                        immutable=True)
+    return response
+
+
+@login_required
+@require_POST
+def upload_create(request):
+    """Начинает загрузку картинки частями: filename, size, sha256."""
+    try:
+        upload = start_upload(
+            request.user, request.POST.get('filename'),
+            request.POST.get('size'), request.POST.get('sha256'),
+        )
+    except UploadError as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    return JsonResponse(upload_state(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def upload_chunk(request, token):
+    """Состояние загрузки (GET) или очередная часть (POST ?offset=N).
+
+    Тело POST - байты части; они пишутся на диск потоком, не собираясь
+    в памяти. После обрыва клиент узнаёт offset через GET и продолжает.
+    """
+    upload = get_object_or_404(Upload, token=token, user=request.user)
+    if request.method == 'POST':
+        try:
+            offset = int(request.GET['offset'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Укажите offset.'}, status=400)
+        try:
+            upload = write_chunk(upload, offset, request)
+        except UploadError as error:
+            return JsonResponse(
+                {'error': str(error), **upload_state(error.upload)},
+                status=error.status,
+            )
+    return JsonResponse(upload_state(upload))
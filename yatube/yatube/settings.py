@@ -148,16 +148,103 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 OBJECTS_PER_PAGE = 10
 
+# Комментарии под постом выводятся порциями по столько штук.
+COMMENTS_PER_PAGE = 20
+
+# Число записей для паджинатора сбрасывается сигналами записи; срок
+# жизни ограничивает расхождение после изменений в обход сигналов.
+PAGINATOR_COUNT_TIMEOUT = 60 * 60
+
+# Авторы, у которых подписчиков больше порога, не раскладывают посты
+# по лентам подписчиков: их посты подтягиваются при чтении ленты.
+FEED_PUSH_MAX_FOLLOWERS = 1000
+
+FEED_RECENT_POSTS = 100
+
+FEED_RECENT_POSTS_TIMEOUT = 60 * 60 * 24
+
+# Фрагменты ленты сбрасываются сменой версии, а не по времени.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Фрагменты страницы поста кэшируются по (id, version) поста.
+POST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Геометрии миниатюр постов: имя -> ('ШxВ', опции sorl-thumbnail).
+# Каждая создаётся в фоне сразу после сохранения поста в ширинах
+# POST_THUMBNAIL_WIDTHS в WebP и в формате оригинала.
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+
+POST_THUMBNAIL_WIDTHS = (480, 960, 1440)
+
+# Ширина карточки поста на странице для атрибута sizes.
+POST_THUMBNAIL_SIZES = '(min-width: 768px) 720px, 100vw'
+
+# Пул потоков для генерации миниатюр (0 - генерировать сразу) и предел
+# числа картинок, ожидающих генерации.
+POST_THUMBNAIL_WORKERS = 2
+
+POST_THUMBNAIL_QUEUE_SIZE = 100
+
+# Ограничения загружаемых картинок; оригиналы больше POST_IMAGE_MAX_SIDE
+# по большей стороне уменьшаются при загрузке.
+POST_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+POST_IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+
+POST_IMAGE_MAX_SIDE = 2560
+
+# Сторона микроминиатюры, которая встраивается в страницу как заглушка
+# до загрузки картинки.
+POST_IMAGE_PLACEHOLDER_SIDE = 16
+
+# Файлы заменённых и удалённых картинок удаляются после фиксации
+# транзакции порциями по POST_IMAGE_CLEANUP_BATCH_SIZE: в фоновом
+# потоке или, если False, сразу в том же потоке.
+POST_IMAGE_CLEANUP_IN_BACKGROUND = True
+
+POST_IMAGE_CLEANUP_BATCH_SIZE = 100
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Картинки постов нужного размера по запросу к /media/resize/<подписанные
+# параметры>/. Результаты хранятся на диске, давно не читанные файлы
+# вытесняются, когда кэш больше RESIZE_CACHE_MAX_SIZE байт.
+RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'resize_cache')
+
+RESIZE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+RESIZE_MAX_SIDE = 2560
+
+# Загрузка картинок частями: части пишутся в UPLOAD_DIR, одна часть не
+# больше UPLOAD_CHUNK_SIZE, незавершённые и неиспользованные загрузки
+# удаляет clear_uploads через UPLOAD_EXPIRY секунд.
+UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+UPLOAD_EXPIRY = 60 * 60 * 24
+
+# Кэш общий для всех процессов сервера: инвалидация по версиям
+# видна сразу во всех воркерах.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
     }
 }
 
+# Тесты переносят кэш во временный файл, чтобы не сбрасывать кэш
+# запущенного сервера.
+TEST_RUNNER = 'core.test_runner.TemporaryCacheRunner'
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 INTERNAL_IPS = [